@@ -0,0 +1,73 @@
+"""
+Benchmark della ricostruzione dello storico del bankroll dalla tabella events.
+
+    python -m benchmarks.bench_bankroll_replay --events 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.database import Database
+
+def populate(db, n_events, seed=0, user_id=1, chat_id=1):
+    """Insert `n_events` settled events plus the initial bankroll row, in one transaction."""
+    rng = np.random.default_rng(seed)
+    odds = np.round(rng.uniform(1.3, 5.0, n_events), 2)
+    stakes = np.round(rng.uniform(1, 50, n_events), 2)
+    outcomes = (rng.random(n_events) < 1 / odds).astype(int)
+    returns = np.where(outcomes == 1, stakes * odds, 0.0)
+    # Some events have no stored return value and go through the fallback
+    returns_list = [None if i % 10 == 0 else r for i, r in enumerate(returns.tolist())]
+    base = np.datetime64("2024-01-01T00:00:00")
+    timestamps = (base + np.arange(n_events) * np.timedelta64(1, "m")).astype(str)
+    timestamps = [ts.replace("T", " ") for ts in timestamps]
+
+    db.cursor.execute('''
+        INSERT INTO bankroll_history (user_id, chat_id, bankroll, description, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, chat_id, 1000.0, "Bankroll iniziale", "2023-12-31 23:59:00"))
+    db.cursor.executemany('''
+        INSERT INTO events (user_id, chat_id, event_name, odds, probability, bankroll, kelly_percentage,
+                            fraction_label, bet_amount, outcome, return_value, timestamp)
+        VALUES (?, ?, ?, ?, 0.5, 1000, 0, '1/10', ?, ?, ?, ?)
+    ''', zip([user_id] * n_events, [chat_id] * n_events, [f"E{i}" for i in range(n_events)],
+             odds.tolist(), stakes.tolist(), outcomes.tolist(), returns_list, timestamps))
+    db.conn.commit()
+    return stakes, odds, outcomes, returns_list
+
+def reference_balance(initial, stakes, odds, outcomes, returns):
+    """Row-by-row replay, the way the bot applies outcomes one at a time."""
+    balance = initial
+    for stake, odd, outcome, ret in zip(stakes, odds, outcomes, returns):
+        if ret is None:
+            ret = stake * odd if outcome == 1 else 0.0
+        balance += ret - stake
+    return round(balance, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = Database(":memory:")
+    stakes, odds, outcomes, returns = populate(db, args.events)
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        final = db.replay_bankroll_history(1, 1)
+        timings.append(time.perf_counter() - start)
+
+    expected = reference_balance(1000.0, stakes.tolist(), odds.tolist(), outcomes.tolist(), returns)
+    assert abs(final - expected) < 0.01, (final, expected)
+    assert db.get_initial_bankroll(1, 1) == 1000.0
+    assert db.get_current_bankroll(1, 1) == final
+
+    print(f"{args.events} eventi: replay in {min(timings) * 1000:.1f} ms (migliore di {args.repeat}), "
+          f"bankroll finale {final:.2f}")
+    db.close()
+
+if __name__ == "__main__":
+    main()
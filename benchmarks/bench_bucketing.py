@@ -0,0 +1,80 @@
+"""
+Benchmark delle fasce di quota della heatmap: ciclo per riga originale contro `pd.cut` sull'intera colonna.
+
+    python -m benchmarks.bench_bucketing --rows 200000 --quantiles 6
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import ledger_bytes
+from routers.heatmap import build_heatmap_rows, transform_csv_to_heatmap_data
+from utils.markets import get_market_from_title, get_odds_range, odds_labels, quantile_odds_edges, ODDS_EDGES
+
+def legacy_heatmap(df: pd.DataFrame):
+    """transform_csv_to_heatmap_data before vectorized bucketing: one get_odds_range call per row."""
+    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
+    df['Puntata'] = pd.to_numeric(df['Puntata'].astype(str).str.replace(',', '.'), errors='coerce')
+    df['Quote'] = pd.to_numeric(df['Quote'].astype(str).str.replace(',', '.'), errors='coerce')
+    df['Profitto'] = pd.to_numeric(df['Profitto'].astype(str).str.replace(',', '.'), errors='coerce')
+
+    grouped_data = {}
+    for _, row in df.iterrows():
+        key = (get_market_from_title(row['Titolo_della_scommessa']), get_odds_range(row['Quote']))
+        stats = grouped_data.setdefault(key, {'wins': 0, 'total': 0, 'total_bet': 0, 'total_profit': 0})
+        stats['total'] += 1
+        stats['total_bet'] += row['Puntata']
+        stats['total_profit'] += row['Profitto']
+        if row['Stato'] == 'Vinto':
+            stats['wins'] += 1
+    return build_heatmap_rows(grouped_data)
+
+def best_of(func, df, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        # The legacy path mutates its input, so every run gets a fresh copy
+        frame = df.copy()
+        start = time.perf_counter()
+        result = func(frame)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def sample_spread(rows):
+    """Bets per populated cell: min, median and max, plus the number of cells below 5 bets."""
+    totals = np.array([int(row[5]) for row in rows])
+    return totals.min(), int(np.median(totals)), totals.max(), int((totals < 5).sum())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--quantiles", type=int, default=6, help="fasce a pari frequenza da confrontare")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = pd.read_csv(io.BytesIO(ledger_bytes(args.rows)), sep=';')
+    settled = raw[raw['Stato'].isin(['Vinto', 'Perso'])].reset_index(drop=True)
+    quantile_edges = quantile_odds_edges(pd.to_numeric(settled['Quote'], errors='coerce'), args.quantiles)
+
+    runs = {
+        "per riga": lambda df: legacy_heatmap(df),
+        "pd.cut": lambda df: transform_csv_to_heatmap_data(df, ODDS_EDGES)[0],
+        "quantili": lambda df: transform_csv_to_heatmap_data(df, quantile_edges)[0],
+    }
+    print(f"{len(settled)} scommesse chiuse")
+    print(f"{'versione':>9} {'tempo (s)':>10} {'min':>6} {'mediana':>8} {'max':>6} {'celle < 5':>10}")
+    results = {}
+    for name, func in runs.items():
+        elapsed, rows = best_of(func, settled, args.repeat)
+        results[name] = rows
+        low, median, high, sparse = sample_spread(rows)
+        print(f"{name:>9} {elapsed:>10.3f} {low:>6} {median:>8} {high:>6} {sparse:>10}")
+
+    if results["per riga"] != results["pd.cut"]:
+        print("ATTENZIONE: le celle di pd.cut differiscono dal ciclo per riga")
+    print(f"Fasce a quantili: {', '.join(odds_labels(quantile_edges))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Benchmark del backtest multi-file: parsing parallelo + merge con deduplica.
+
+    python -m benchmarks.bench_merge --files 8 --rows 200000
+"""
+import argparse
+import os
+import time
+
+from benchmarks.fixtures import generate_rows, rows_to_bytes
+from utils import ledger
+
+def run(contents, workers):
+    os.environ["LEDGER_PARSE_WORKERS"] = str(workers)
+    ledger._pool = None
+    if workers > 1:
+        # Warm-up: start the worker processes outside the timed section
+        ledger.parse_ledgers(contents[:2])
+    start = time.perf_counter()
+    merged, duplicates = ledger.merge_ledgers(ledger.parse_ledgers(contents))
+    elapsed = time.perf_counter() - start
+    if ledger._pool is not None:
+        ledger._pool.shutdown()
+    return elapsed, len(merged), duplicates
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=200_000, help="righe per file")
+    parser.add_argument("--overlap", type=float, default=0.1, help="quota di righe condivise con il file successivo")
+    args = parser.parse_args()
+
+    # Consecutive files share `overlap` rows, like overlapping export windows
+    overlap = int(args.rows * args.overlap)
+    rows = list(generate_rows(args.files * args.rows + overlap))
+    contents = [rows_to_bytes(rows[i * args.rows:(i + 1) * args.rows + overlap]) for i in range(args.files)]
+
+    baseline = None
+    print(f"{args.files} file x {args.rows} righe, {os.cpu_count()} core")
+    print(f"{'worker':>6} {'tempo (s)':>10} {'speed-up':>9} {'righe':>10} {'duplicati':>10}")
+    for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+        elapsed, n_rows, duplicates = run(contents, workers)
+        baseline = baseline or elapsed
+        print(f"{workers:>6} {elapsed:>10.2f} {baseline / elapsed:>8.2f}x {n_rows:>10} {duplicates:>10}")
+
+if __name__ == "__main__":
+    main()
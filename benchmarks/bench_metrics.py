@@ -0,0 +1,81 @@
+"""
+Benchmark di process_betting_data: implementazione multi-pass originale contro il kernel su array.
+
+    python -m benchmarks.bench_metrics --rows 1000000
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import ledger_bytes
+from utils.metrics import betting_arrays, betting_metrics
+
+def legacy_metrics(df: pd.DataFrame):
+    """The statistics part of process_betting_data before the metrics kernel, kept as a reference."""
+    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
+    df['Data'] = pd.to_datetime(df['Data'], dayfirst=True, errors='coerce')
+    df['Puntata'] = pd.to_numeric(df['Puntata'].astype(str).str.replace(',', '.'), errors='coerce')
+    df['Quote'] = pd.to_numeric(df['Quote'].astype(str).str.replace(',', '.'), errors='coerce')
+    df['Profitto'] = pd.to_numeric(df['Profitto'].astype(str).str.replace(',', '.'), errors='coerce')
+    df.dropna(subset=['Data', 'Puntata', 'Quote', 'Stato'], inplace=True)
+    df = df[df['Stato'] != 'Rimborso']
+
+    daily_profit = df.set_index('Data')['Profitto'].resample('D').sum()
+    df['Cumulative_Profit'] = df['Profitto'].cumsum()
+    peak = df['Cumulative_Profit'].cummax()
+    return {
+        "total_bets": len(df),
+        "wins": int((df['Stato'] == 'Vinto').sum()),
+        "losses": int((df['Stato'] == 'Perso').sum()),
+        "voids": int((df['Stato'] == 'Nullo').sum()),
+        "avg_odds": df['Quote'].mean(),
+        "total_staked": df['Puntata'].sum(),
+        "total_profit": df['Profitto'].sum(),
+        "max_drawdown": (df['Cumulative_Profit'] - peak).min(),
+        "profit_mean": df['Profitto'].mean(),
+        "profit_std": df['Profitto'].std(),
+        "sharpe_ratio": (daily_profit.mean() / daily_profit.std()) * np.sqrt(365),
+    }
+
+def kernel_metrics(df: pd.DataFrame):
+    return betting_metrics(**betting_arrays(df))
+
+def measure(func, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = pd.read_csv(io.BytesIO(ledger_bytes(args.rows)), sep=';')
+    print(f"{args.rows} righe")
+    print(f"{'versione':>8} {'tempo (s)':>10} {'picco allocazioni (MB)':>24}")
+    results = {}
+    for name, func in (("legacy", legacy_metrics), ("kernel", kernel_metrics)):
+        best_time, best_peak = float("inf"), 0
+        for _ in range(args.repeat):
+            # The legacy path mutates its input, so every run gets a fresh copy
+            result, elapsed, peak = measure(func, raw.copy())
+            best_time, best_peak = min(best_time, elapsed), peak
+        results[name] = result
+        print(f"{name:>8} {best_time:>10.3f} {best_peak / 2**20:>24.1f}")
+
+    for key, expected in results["legacy"].items():
+        actual = results["kernel"][key]
+        if not np.isclose(actual, expected, equal_nan=True):
+            print(f"ATTENZIONE: {key} differisce: legacy={expected} kernel={actual}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark del rendering della pagina heatmap: stringa unica contro rendering in streaming,
+e compilazione dei template con e senza cache del bytecode.
+
+    python -m benchmarks.bench_render --markets 100 --odds 40
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from utils.templating import STREAM_CHUNK_ITEMS, _buffered, create_environment
+
+def synthetic_results(n_markets, n_odds):
+    """Heatmap results shaped like run_heatmap's, with n_markets x n_odds populated cells."""
+    markets = [f"Mercato {i}" for i in range(n_markets)]
+    odds_ranges = [f"{1 + j / 10:.1f}-{1 + (j + 1) / 10:.1f}" for j in range(n_odds)]
+    raw_data = []
+    table = {}
+    for i, market in enumerate(markets):
+        table[market] = {}
+        for j, odds_range in enumerate(odds_ranges):
+            roi = f"{((i * 7 + j * 13) % 60) - 30:+.1f}%"
+            table[market][odds_range] = roi
+            raw_data.append({"Market": market, "OddsRange": odds_range, "WinRate": f"{(i + j) % 100:.1f}%",
+                             "ROI": roi, "Note": "Discreto (Campione minimo)", "Total": str(20 + i + j)})
+    return {
+        "filename": "bench.csv", "period": "all", "num_rows": len(raw_data) * 20, "duplicates_removed": 0,
+        "heatmap_table": table, "markets": markets, "odds_ranges": odds_ranges,
+        "odds_edges": [], "raw_data": raw_data,
+    }
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def render_full(template, context):
+    return len(template.render(context))
+
+def render_streamed(template, context, first_chunk):
+    start = time.perf_counter()
+    size = 0
+    for chunk in _buffered(template.generate(context), STREAM_CHUNK_ITEMS):
+        if not first_chunk:
+            first_chunk.append(time.perf_counter() - start)
+        size += len(chunk)
+    return size
+
+def compile_time(cache_dir):
+    """Load every page in a fresh environment, as a new worker or a cold start would."""
+    env = create_environment(cache_dir=cache_dir)
+    start = time.perf_counter()
+    for name in ("index.html", "calcola.html", "backtest.html", "heatmap.html"):
+        env.get_template(name)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--markets", type=int, default=100)
+    parser.add_argument("--odds", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cold = compile_time(cache_dir)
+        warm = min(compile_time(cache_dir) for _ in range(args.repeat))
+        print(f"Compilazione dei template: {cold * 1000:.1f} ms senza cache, {warm * 1000:.1f} ms dalla cache del bytecode")
+
+        template = create_environment(cache_dir=cache_dir).get_template("heatmap.html")
+        context = {"request": None, "results": synthetic_results(args.markets, args.odds)}
+        print(f"{args.markets * args.odds} celle")
+        print(f"{'versione':>9} {'tempo (s)':>10} {'primo blocco (ms)':>18} {'picco allocazioni (MB)':>24} {'KB HTML':>9}")
+
+        best = min((measure(lambda: render_full(template, context)) for _ in range(args.repeat)), key=lambda m: m[1])
+        size, elapsed, peak = best
+        print(f"{'stringa':>9} {elapsed:>10.3f} {elapsed * 1000:>18.1f} {peak / 2**20:>24.1f} {size / 1024:>9.0f}")
+
+        runs = []
+        for _ in range(args.repeat):
+            first_chunk = []
+            size, elapsed, peak = measure(lambda: render_streamed(template, context, first_chunk))
+            runs.append((elapsed, first_chunk[0], peak, size))
+        elapsed, first, peak, size = min(runs)
+        print(f"{'streaming':>9} {elapsed:>10.3f} {first * 1000:>18.1f} {peak / 2**20:>24.1f} {size / 1024:>9.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark del replay delle strategie di puntata: sweep di centinaia di strategie Kelly sulle stesse scommesse.
+
+    python -m benchmarks.bench_staking --rows 20000 --fractions 40 --edges 10
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import ledger_bytes
+from routers.backtest import run_backtest
+from utils.kelly import kelly_criterion, round_to_nearest_five_cents
+from utils.metrics import betting_arrays, OUTCOME_WIN, OUTCOME_LOSS
+from utils.staking import DEFAULT_BANKROLL, default_strategies, kelly_grid, replay_strategies
+
+def scalar_replay(outcome, odds, strategy, initial_bankroll=DEFAULT_BANKROLL):
+    """One strategy at a time with the scalar helpers used by /calcola, kept as a reference."""
+    bankroll = initial_bankroll
+    for result, odd in zip(outcome, odds):
+        if result not in (OUTCOME_WIN, OUTCOME_LOSS):
+            continue
+        if strategy["fraction"] is None:
+            stake = strategy["flat_stake"]
+        else:
+            kelly = max(kelly_criterion(odd, 1 / odd + strategy["edge"]), 0) if odd > 1 else 0
+            stake = kelly * bankroll * strategy["fraction"]
+        stake = min(round_to_nearest_five_cents(stake), max(bankroll, 0))
+        bankroll += stake * (odd - 1) if result == OUTCOME_WIN else -stake
+    return bankroll
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--fractions", type=int, default=40, help="frazioni di Kelly fra 1/40 e 1/2")
+    parser.add_argument("--edges", type=int, default=10, help="edge fra 0 e 5 punti percentuali")
+    parser.add_argument("--check", type=int, default=5, help="strategie verificate con il replay scalare")
+    args = parser.parse_args()
+
+    arrays = betting_arrays(pd.read_csv(io.BytesIO(ledger_bytes(args.rows)), sep=';'))
+    outcome, odds, day = arrays["outcome"], arrays["odds"], arrays["day"]
+    strategies = default_strategies() + kelly_grid(np.linspace(1 / 40, 1 / 2, args.fractions),
+                                                   np.linspace(0, 0.05, args.edges))
+
+    start = time.perf_counter()
+    results = replay_strategies(outcome, odds, day, strategies)
+    elapsed = time.perf_counter() - start
+    print(f"{len(strategies)} strategie x {len(outcome)} scommesse: {elapsed:.3f} s")
+
+    start = time.perf_counter()
+    for strategy, result in list(zip(strategies, results))[:args.check]:
+        expected = scalar_replay(outcome.tolist(), odds.tolist(), strategy)
+        if not np.isclose(result["final_bankroll"], expected):
+            print(f"ATTENZIONE: {strategy['name']} differisce: scalare={expected} matrice={result['final_bankroll']}")
+    per_strategy = (time.perf_counter() - start) / max(args.check, 1)
+    print(f"Replay scalare: {per_strategy:.3f} s per strategia (stima per lo sweep: {per_strategy * len(strategies):.1f} s)")
+
+    # Real exports list the newest bets first: the comparison must not depend on the file order
+    oldest_first = run_backtest([ledger_bytes(args.rows)], ["a.csv"], compare_staking=True)["staking"]
+    newest_first = run_backtest([ledger_bytes(args.rows, newest_first=True)], ["a.csv"], compare_staking=True)["staking"]
+    if oldest_first != newest_first:
+        print("ATTENZIONE: il confronto delle strategie cambia con l'ordine delle righe nel file")
+
+    best = sorted(results, key=lambda result: result["final_bankroll"], reverse=True)[:5]
+    print(f"{'strategia':>14} {'edge':>6} {'bankroll':>12} {'ROI':>8} {'drawdown':>10} {'Sharpe':>7}")
+    for result in best:
+        print(f"{result['name']:>14} {result['edge']:>6.3f} {result['final_bankroll']:>12.2f} "
+              f"{result['roi']:>7.2f}% {result['max_drawdown']:>10.2f} {result['sharpe_ratio']:>7.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Generatore di export Bet-Analytix sintetici per benchmark e load test."""
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+
+COLUMNS = [
+    "Data", "Tipo", "Sport", "Titolo della scommessa", "Quote", "Puntata", "Vincita", "Profitto",
+    "Stato", "Bookmaker", "Tipster", "Categoria", "Competizioni", "Tipo di scommessa", "Closing Odds",
+    "Commissione", "Bonus di vincita", "Live", "Scommessa gratuita", "Cashout", "Eachway", "Commento",
+]
+
+SELECTIONS = [
+    "(1)", "(X2)", "(1X)", "(Over 2,5)", "(Under 2,5)", "(Entrambe segnano)",
+    "(Handicap asiatico -1)", "(Over 9,5 corner)", "(Over 4,5 cartellini)", "(Risultato esatto 2-1)",
+]
+TEAMS = ["Inter", "Milan", "Juventus", "Napoli", "Roma", "Lazio", "Atalanta", "Fiorentina",
+         "Bologna", "Torino", "Genoa", "Verona", "Udinese", "Lecce", "Empoli", "Cagliari"]
+BOOKMAKERS = ["Bet365", "Betfair", "Snai", "Sisal", "Eurobet"]
+
+def generate_rows(n_rows, seed=0, start=datetime(2023, 1, 1), bookmaker=None):
+    """Yield `n_rows` synthetic bets in date order, as lists of strings."""
+    rng = random.Random(seed)
+    when = start
+    for _ in range(n_rows):
+        when += timedelta(minutes=rng.randint(1, 240))
+        home, away = rng.sample(TEAMS, 2)
+        odds = round(rng.uniform(1.2, 7.0), 2)
+        stake = round(rng.uniform(5, 60), 2)
+        roll = rng.random()
+        if roll < 0.02:
+            status, payout = "Rimborso", stake
+        elif roll < 0.04:
+            status, payout = "Nullo", stake
+        elif roll < 0.04 + 0.96 / odds * 1.03:
+            status, payout = "Vinto", round(stake * odds, 2)
+        else:
+            status, payout = "Perso", 0.0
+        profit = round(payout - stake, 2)
+        winnings = payout if payout > 0 else profit
+        closing = round(odds * rng.uniform(0.9, 1.05), 3)
+        yield [
+            when.strftime("%d/%m/%Y %H:%M"), "Singola", "Football",
+            f"{home} - {away} {rng.choice(SELECTIONS)}",
+            f"{odds:.3f}", f"{stake:.2f}", f"{winnings:.2f}", f"{profit:.2f}", status,
+            bookmaker or rng.choice(BOOKMAKERS), "", "", "", "", f"{closing:.3f}",
+            "", "", "", "", "", "", "",
+        ]
+
+def write_ledger(fileobj, rows):
+    """Write a ';'-separated ledger to a text file object."""
+    writer = csv.writer(fileobj, delimiter=";", quoting=csv.QUOTE_ALL)
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+
+def rows_to_bytes(rows):
+    """Return the given rows as a whole ledger in UTF-8 bytes, ready to be uploaded."""
+    buffer = io.StringIO()
+    write_ledger(buffer, rows)
+    return buffer.getvalue().encode("utf-8")
+
+def ledger_bytes(n_rows, seed=0, newest_first=False, **kwargs):
+    """
+    Return a synthetic ledger of `n_rows` bets as UTF-8 bytes.
+
+    With `newest_first` the bets are listed from the most recent, like real Bet-Analytix exports.
+    """
+    rows = generate_rows(n_rows, seed=seed, **kwargs)
+    if newest_first:
+        rows = list(rows)[::-1]
+    return rows_to_bytes(rows)
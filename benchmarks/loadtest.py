@@ -0,0 +1,242 @@
+"""
+Load test end-to-end: avvia l'app con uvicorn e la bombarda con client concorrenti.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.loadtest --users 50 --duration 30 --rows 5000 --workers 2 --output report.json
+
+Con --compression gzip|xz|zstd i file sono caricati compressi: confrontando il
+report con quello di un run non compresso si misurano byte inviati e latenza.
+La route "export" (es. --mix export:1) scarica la heatmap in NDJSON con fasce a quantili.
+
+Con --url il test usa un server già avviato invece di lanciarne uno
+(in quel caso la RSS del server non viene misurata).
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import lzma
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import ledger_bytes
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("Il load test richiede httpx: pip install -r benchmarks/requirements.txt")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Marker of the error paragraph rendered by every template: those pages answer 200 on failure
+ERROR_MARKER = 'style="color: red;"'
+
+def parse_mix(mix):
+    """'calcola:2,backtest:1' -> {'calcola': 2.0, 'backtest': 1.0}"""
+    weights = {}
+    for item in mix.split(","):
+        route, _, weight = item.partition(":")
+        weights[route.strip()] = float(weight or 1)
+    return weights
+
+def compress(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data), ".gz"
+    if compression == "xz":
+        return lzma.compress(data), ".xz"
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data), ".zst"
+    return data, ""
+
+def build_requests(rows, period, compression="none"):
+    """Request factories per route; the fixture is generated once and shared by every client."""
+    ledger, suffix = compress(ledger_bytes(rows), compression)
+    filename = f"Export Bet-Analytix.csv{suffix}"
+
+    def calcola(client):
+        odds = round(random.uniform(1.5, 4.0), 2)
+        probability = round(min(0.95, 1 / odds + random.uniform(0.01, 0.1)), 2)
+        return client.post("/calcola", data={"odds": odds, "probability": probability, "bankroll": 1000})
+
+    def backtest(client):
+        return client.post("/backtest", files={"csv_file": (filename, ledger, "application/octet-stream")})
+
+    def heatmap(client):
+        return client.post("/heatmap", files={"csv_file": (filename, ledger, "application/octet-stream")},
+                           data={"period": period})
+
+    def export(client):
+        # Quantile buckets read the upload twice: covers re-reading compressed uploads
+        return client.post("/heatmap/export", files={"csv_file": (filename, ledger, "application/octet-stream")},
+                           data={"period": period, "format": "ndjson", "odds_quantiles": 6})
+
+    return {"calcola": calcola, "backtest": backtest, "heatmap": heatmap, "export": export}, len(ledger)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port, workers):
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=ROOT_DIR)
+
+async def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/hello")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Il server non risponde su {base_url}")
+
+def process_tree_rss(pid):
+    """RSS in bytes of a process and all its children (uvicorn workers), read from /proc."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+async def sample_rss(pid, peak, stop):
+    while not stop.is_set():
+        peak[0] = max(peak[0], process_tree_rss(pid))
+        await asyncio.sleep(0.2)
+
+async def user(client, routes, weights, deadline, samples):
+    names = list(weights)
+    probabilities = [weights[name] for name in names]
+    while time.monotonic() < deadline:
+        route = random.choices(names, probabilities)[0]
+        start = time.perf_counter()
+        error = False
+        try:
+            response = await routes[route](client)
+            error = response.status_code >= 400 or ERROR_MARKER in response.text
+        except httpx.HTTPError:
+            error = True
+        samples[route].append((time.perf_counter() - start, error))
+
+def summarize(samples, elapsed):
+    report = {}
+    for route, route_samples in samples.items():
+        if not route_samples:
+            continue
+        latencies = np.array([latency for latency, _ in route_samples]) * 1000
+        errors = sum(1 for _, error in route_samples if error)
+        report[route] = {
+            "requests": len(route_samples),
+            "throughput_rps": len(route_samples) / elapsed,
+            "error_rate": errors / len(route_samples),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        }
+    return report
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    routes, upload_bytes = build_requests(args.rows, args.period, args.compression)
+    unknown = set(weights) - set(routes)
+    if unknown:
+        raise SystemExit(f"Route sconosciute nel mix: {', '.join(sorted(unknown))}")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        server = start_server(port, args.workers)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_until_ready(base_url)
+        peak_rss = [0]
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(server.pid, peak_rss, stop)) if server else None
+
+        samples = {route: [] for route in weights}
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            start = time.monotonic()
+            deadline = start + args.duration
+            await asyncio.gather(*(user(client, routes, weights, deadline, samples) for _ in range(args.users)))
+            elapsed = time.monotonic() - start
+
+        if sampler:
+            stop.set()
+            await sampler
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    total_requests = sum(len(route_samples) for route_samples in samples.values())
+    return {
+        "config": {
+            "users": args.users, "duration_s": args.duration, "rows": args.rows,
+            "compression": args.compression, "upload_bytes": upload_bytes,
+            "workers": args.workers, "mix": weights, "url": args.url,
+        },
+        "throughput_rps": total_requests / elapsed,
+        "requests": total_requests,
+        "server_peak_rss_mb": peak_rss[0] / 2**20 if server else None,
+        "routes": summarize(samples, elapsed),
+    }
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['users']} utenti, {config['duration_s']} s, fixture da {config['rows']} righe "
+          f"({config['upload_bytes'] / 1024:.0f} KB caricati, compressione: {config['compression']}), "
+          f"{config['workers']} worker uvicorn")
+    print(f"{'route':>10} {'richieste':>10} {'req/s':>8} {'errori':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in report["routes"].items():
+        print(f"{route:>10} {stats['requests']:>10} {stats['throughput_rps']:>8.1f} {stats['error_rate']:>7.1%} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    print(f"Totale: {report['requests']} richieste, {report['throughput_rps']:.1f} req/s")
+    if report["server_peak_rss_mb"] is not None:
+        print(f"Picco RSS del server: {report['server_peak_rss_mb']:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="client concorrenti")
+    parser.add_argument("--duration", type=float, default=30, help="durata in secondi")
+    parser.add_argument("--rows", type=int, default=5000, help="righe del file caricato su /backtest e /heatmap")
+    parser.add_argument("--mix", default="calcola:2,backtest:1,heatmap:1", help="pesi delle route")
+    parser.add_argument("--compression", choices=["none", "gzip", "xz", "zstd"], default="none",
+                        help="comprime i file caricati")
+    parser.add_argument("--period", default="all", help="periodo inviato a /heatmap")
+    parser.add_argument("--workers", type=int, default=1, help="worker uvicorn")
+    parser.add_argument("--timeout", type=float, default=120, help="timeout per richiesta (s)")
+    parser.add_argument("--url", help="usa un server già avviato invece di lanciarne uno")
+    parser.add_argument("--output", help="salva il report JSON per confrontare release e configurazioni")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 import os
-from routers import calcola, backtest, heatmap
+from routers import calcola, backtest, heatmap, jobs
+from utils.templating import templates
 
 # Get the absolute path of the current file's directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,11 +14,10 @@ app = FastAPI()
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 app.mount("/assets", StaticFiles(directory=os.path.join(BASE_DIR, "assets")), name="assets")
 
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
-
 app.include_router(calcola.router)
 app.include_router(backtest.router)
 app.include_router(heatmap.router)
+app.include_router(jobs.router)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
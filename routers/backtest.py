@@ -1,17 +1,22 @@
-from fastapi import APIRouter, Request, File, UploadFile
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Request, File, UploadFile, Form, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 import pandas as pd
 import numpy as np
-import io
 from datetime import datetime
-import os
+from typing import List
 
-# Get the absolute path of the project's root directory
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from starlette.concurrency import run_in_threadpool
+
+from utils.calibration import update_calibration_index
+from utils.export import EXPORT_CHUNK_ROWS, EXPORT_MEDIA_TYPES, spool_upload, serialize_frame, csv_header
+from utils.jobs import job_queue, get_client_id, JobLimitExceeded
+from utils.ledger import read_ledger, parse_ledgers, merge_ledgers, iter_ledger, sort_by_date
+from utils.markets import get_market_from_title, bucket_odds
+from utils.metrics import betting_arrays, betting_metrics, clean_bets
+from utils.staking import DEFAULT_BANKROLL, DEFAULT_EDGE, default_strategies, replay_strategies
+from utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 def calculate_confidence_interval(wins, total, confidence=0.95):
     """Calculate confidence interval for win rate."""
@@ -58,88 +63,189 @@ def analyze_sample_size(total_bets):
     else:
         return "❌ Limitato: il campione è troppo piccolo per un'analisi affidabile."
 
-def process_betting_data(df: pd.DataFrame):
-    """Process the betting data from a DataFrame and return statistics."""
-    # Clean column names
-    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
-
-    # Data transformation
-    df['Data'] = pd.to_datetime(df['Data'], errors='coerce')
-    df['Puntata'] = pd.to_numeric(df['Puntata'].astype(str).str.replace(',', '.'), errors='coerce')
-    df['Quote'] = pd.to_numeric(df['Quote'].astype(str).str.replace(',', '.'), errors='coerce')
-    df['Profitto'] = pd.to_numeric(df['Profitto'].astype(str).str.replace(',', '.'), errors='coerce')
-
-    # Remove rows with missing essential data
-    df.dropna(subset=['Data', 'Puntata', 'Quote', 'Stato'], inplace=True)
-    df = df[df['Stato'] != 'Rimborso']
-    
-    # Calculate profit if not present
-    if 'Profitto' not in df.columns or df['Profitto'].isnull().all():
-        df['Profitto'] = np.where(df['Stato'] == 'Vinto', (df['Puntata'] * df['Quote']) - df['Puntata'], -df['Puntata'])
-        df.loc[df['Stato'] == 'Nullo', 'Profitto'] = 0
+def process_betting_data(df: pd.DataFrame, arrays=None):
+    """Process the betting data from a DataFrame (or its precomputed `betting_arrays`) and return statistics."""
+    metrics = betting_metrics(**(arrays if arrays is not None else betting_arrays(df)))
 
     # Basic statistics
-    total_bets = len(df)
-    wins = (df['Stato'] == 'Vinto').sum()
-    losses = (df['Stato'] == 'Perso').sum()
-    voids = (df['Stato'] == 'Nullo').sum()
+    total_bets = metrics["total_bets"]
+    wins = metrics["wins"]
     win_rate = (wins / total_bets) * 100 if total_bets > 0 else 0
-    avg_odds = df['Quote'].mean()
-    total_staked = df['Puntata'].sum()
-    total_profit = df['Profitto'].sum()
+    total_staked = metrics["total_staked"]
+    total_profit = metrics["total_profit"]
     roi = (total_profit / total_staked) * 100 if total_staked > 0 else 0
-
-    # Advanced metrics
-    df['Cumulative_Profit'] = df['Profitto'].cumsum()
-    peak = df['Cumulative_Profit'].cummax()
-    drawdown = (df['Cumulative_Profit'] - peak)
-    max_drawdown = drawdown.min()
-    
-    # Sharpe Ratio
-    daily_profit = df.set_index('Data')['Profitto'].resample('D').sum()
-    if len(daily_profit) > 1 and daily_profit.std() != 0:
-        sharpe_ratio = (daily_profit.mean() / daily_profit.std()) * np.sqrt(365)
-    else:
-        sharpe_ratio = 0
+    sharpe_ratio = metrics["sharpe_ratio"]
 
     # Confidence Interval
     ci_lower, ci_upper = calculate_confidence_interval(wins, total_bets)
     
     # Risk analysis
-    risk_analysis = analyze_risk(df['Profitto'].std(), df['Profitto'].mean(), sharpe_ratio)
+    risk_analysis = analyze_risk(metrics["profit_std"], metrics["profit_mean"], sharpe_ratio)
     sample_size_analysis = analyze_sample_size(total_bets)
 
     return {
         "total_bets": total_bets,
         "wins": wins,
-        "losses": losses,
-        "voids": voids,
+        "losses": metrics["losses"],
+        "voids": metrics["voids"],
         "win_rate": f"{win_rate:.2f}%",
-        "avg_odds": f"{avg_odds:.2f}",
+        "avg_odds": f"{metrics['avg_odds']:.2f}",
         "total_staked": f"{total_staked:.2f}",
         "total_profit": f"{total_profit:.2f}",
         "roi": f"{roi:.2f}%",
-        "max_drawdown": f"{max_drawdown:.2f}",
+        "max_drawdown": f"{metrics['max_drawdown']:.2f}",
         "sharpe_ratio": f"{sharpe_ratio:.2f}",
         "confidence_interval": f"{ci_lower:.2f}% - {ci_upper:.2f}%",
         "risk_analysis": risk_analysis,
         "sample_size_analysis": sample_size_analysis,
     }
 
+def staking_results(arrays, edge=DEFAULT_EDGE, initial_bankroll=DEFAULT_BANKROLL):
+    """Replay flat staking and fractional Kelly on the same bets, formatted for the template."""
+    replayed = replay_strategies(arrays["outcome"], arrays["odds"], arrays["day"],
+                                 default_strategies(edge, initial_bankroll), initial_bankroll)
+    return [{
+        "name": result["name"],
+        "bets_placed": result["bets_placed"],
+        "final_bankroll": f"{result['final_bankroll']:.2f}",
+        "total_staked": f"{result['total_staked']:.2f}",
+        "total_profit": f"{result['total_profit']:.2f}",
+        "roi": f"{result['roi']:.2f}%",
+        "max_drawdown": f"{result['max_drawdown']:.2f}",
+        "sharpe_ratio": f"{result['sharpe_ratio']:.2f}",
+    } for result in replayed]
+
+def run_backtest(contents, filenames, edge=DEFAULT_EDGE, initial_bankroll=DEFAULT_BANKROLL,
+                 compare_staking=False, progress=None):
+    """
+    Parse one or more uploaded ledgers and return the backtest statistics.
+
+    With several files the ledgers are parsed in parallel and merged in date order,
+    dropping bets that appear in more than one export; the statistics of each file
+    are returned under "files". With `compare_staking` the same bets are replayed
+    with flat and Kelly staking (probability = implied + `edge`) under "staking":
+    the replay walks the bets one at a time, so it is opt-in.
+    """
+    if len(contents) == 1:
+        df = read_ledger(contents[0], progress=progress)
+        update_calibration_index(df)
+        arrays = betting_arrays(df)
+        results = process_betting_data(df, arrays)
+        results["filename"] = filenames[0]
+        if compare_staking:
+            # Kelly stakes depend on the bankroll path: replay the bets in time order
+            results["staking"] = staking_results(betting_arrays(sort_by_date(df)), edge, initial_bankroll)
+        return results
+
+    parsed = parse_ledgers(contents, progress=progress)
+    merged, duplicates = merge_ledgers(parsed)
+    update_calibration_index(merged)
+    arrays = betting_arrays(merged)
+    results = process_betting_data(merged, arrays)
+    results["filename"] = ", ".join(filenames)
+    if compare_staking:
+        results["staking"] = staking_results(arrays, edge, initial_bankroll)
+    results["duplicates_removed"] = duplicates
+    results["files"] = []
+    for filename, (df, _) in zip(filenames, parsed):
+        file_results = process_betting_data(df)
+        file_results["filename"] = filename
+        results["files"].append(file_results)
+    return results
+
+EXPORT_BET_COLUMNS = ['Data', 'Titolo_della_scommessa', 'Stato', 'Quote', 'Puntata', 'Profitto',
+                      'Mercato', 'Fascia_Quota', 'Profitto_Cumulato']
+
+def iter_enriched_bets(source, fmt):
+    """
+    Genera le scommesse del ledger arricchite con mercato, fascia di quota e
+    profitto cumulato, un blocco alla volta, come CSV o NDJSON.
+
+    Le righe considerate e il profitto cumulato sono gli stessi del backtest.
+    """
+    try:
+        if fmt == "csv":
+            yield csv_header(EXPORT_BET_COLUMNS)
+
+        cumulative = 0.0
+        for chunk in iter_ledger(source, EXPORT_CHUNK_ROWS):
+            arrays, valid = clean_bets(chunk)
+            if valid is not None:
+                chunk = chunk[valid]
+            if len(chunk) == 0:
+                continue
+
+            running = np.cumsum(np.nan_to_num(arrays["profit"])) + cumulative
+            cumulative = float(running[-1])
+            titles = chunk['Titolo della scommessa']
+            odds = pd.Series(arrays["odds"], index=chunk.index)
+            enriched = pd.DataFrame({
+                'Data': chunk['Data'],
+                'Titolo_della_scommessa': titles,
+                'Stato': chunk['Stato'],
+                'Quote': odds,
+                'Puntata': arrays["stake"],
+                'Profitto': arrays["profit"],
+                'Mercato': titles.map({title: get_market_from_title(title) for title in titles.unique()}),
+                'Fascia_Quota': bucket_odds(odds)[0],
+                'Profitto_Cumulato': running.round(2),
+            }, index=chunk.index)
+            yield serialize_frame(enriched, fmt)
+    finally:
+        source.close()
+
 @router.get("/backtest", response_class=HTMLResponse)
 async def get_backtest_form(request: Request):
     return templates.TemplateResponse("backtest.html", {"request": request})
 
 @router.post("/backtest", response_class=HTMLResponse)
-async def post_backtest_form(request: Request, csv_file: UploadFile = File(...)):
+async def post_backtest_form(
+    request: Request,
+    csv_file: List[UploadFile] = File(...),
+    edge: float = Form(DEFAULT_EDGE),
+    initial_bankroll: float = Form(DEFAULT_BANKROLL),
+    compare_staking: bool = Form(False)
+):
     try:
-        content = await csv_file.read()
-        # Use a different separator if needed, e.g., sep=';'
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')), sep=';')
-        
-        results = process_betting_data(df)
-        results["filename"] = csv_file.filename
+        contents = [await upload.read() for upload in csv_file]
+        # Off the event loop: with the staking comparison the analysis can take seconds
+        results = await run_in_threadpool(run_backtest, contents, [upload.filename for upload in csv_file],
+                                          edge, initial_bankroll, compare_staking)
 
         return templates.TemplateResponse("backtest.html", {"request": request, "results": results})
     except Exception as e:
-        return templates.TemplateResponse("backtest.html", {"request": request, "error": str(e)}) 
\ No newline at end of file
+        return templates.TemplateResponse("backtest.html", {"request": request, "error": str(e)}) 
+
+@router.post("/backtest/jobs")
+async def post_backtest_job(
+    request: Request,
+    csv_file: List[UploadFile] = File(...),
+    edge: float = Form(DEFAULT_EDGE),
+    initial_bankroll: float = Form(DEFAULT_BANKROLL),
+    compare_staking: bool = Form(False)
+):
+    """Run the backtest in the background and return the job id immediately."""
+    contents = [await upload.read() for upload in csv_file]
+    try:
+        job_id = job_queue.submit(get_client_id(request), "backtest", run_backtest,
+                                  contents, [upload.filename for upload in csv_file], edge, initial_bankroll,
+                                  compare_staking)
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+
+@router.post("/backtest/export")
+async def post_backtest_export(
+    csv_file: UploadFile = File(...),
+    fmt: str = Form("csv", alias="format")
+):
+    """Stream the enriched bets of the uploaded ledger as CSV or NDJSON."""
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Formato non supportato: usa 'csv' o 'ndjson'.")
+    source = await run_in_threadpool(spool_upload, csv_file.file)
+    return StreamingResponse(
+        iter_enriched_bets(source, fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="backtest.{fmt}"'},
+    )
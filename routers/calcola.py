@@ -1,17 +1,14 @@
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from typing import Optional
-import os
 
-from utils.kelly import round_to_nearest_five_cents
-
-# Get the absolute path of the project's root directory
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from utils.calibration import calibration_index
+from utils.kelly import round_to_nearest_five_cents, KELLY_FRACTIONS
+from utils.markets import MARKET_ORDER
+from utils.templating import templates
 
 router = APIRouter()
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 class KellyResult(BaseModel):
     odds: float
@@ -26,34 +23,47 @@ class KellyResult(BaseModel):
     advantage_judgment: str
     fraction_lines: list
     expected_profit_percentage: float
+    calibration: Optional[dict] = None
 
 @router.get("/calcola", response_class=HTMLResponse)
 async def get_calcola_form(request: Request):
-    return templates.TemplateResponse("calcola.html", {"request": request})
+    return templates.TemplateResponse("calcola.html", {"request": request, "markets": MARKET_ORDER})
 
 @router.post("/calcola", response_class=HTMLResponse)
 async def post_calcola_form(
     request: Request,
     odds: float = Form(...),
-    probability: float = Form(...),
-    bankroll: float = Form(...)
+    probability: Optional[float] = Form(None),
+    bankroll: float = Form(...),
+    market: Optional[str] = Form(None)
 ):
+    form = {"odds": odds, "probability": probability if probability is not None else "", "bankroll": bankroll, "market": market}
     error = None
     if odds <= 1:
         error = "La quota deve essere maggiore di 1."
-    elif not 0 < probability < 1:
+    elif probability is not None and not 0 < probability < 1:
         error = "La probabilità deve essere compresa tra 0 e 1."
     elif bankroll <= 0:
         error = "Il bankroll deve essere maggiore di 0."
-    
+
+    calibration = None
+    if error is None and probability is None:
+        # Use the historical win rate of the market × odds-range cell instead
+        if market:
+            calibration = calibration_index.suggest(market, odds)
+        if calibration is None:
+            error = "Inserisci la probabilità: non c'è uno storico per questo mercato e fascia di quota."
+        else:
+            probability = calibration["probability"]
+
     if error:
-        return templates.TemplateResponse("calcola.html", {"request": request, "error": error})
+        return templates.TemplateResponse("calcola.html", {"request": request, "error": error, "markets": MARKET_ORDER, "form": form})
 
     kelly_percentage = ((odds * probability) - 1) / (odds - 1)
     
     if kelly_percentage <= 0:
         error = "La frazione di Kelly è negativa o zero. Non c'è valore atteso positivo per questa scommessa."
-        return templates.TemplateResponse("calcola.html", {"request": request, "error": error})
+        return templates.TemplateResponse("calcola.html", {"request": request, "error": error, "markets": MARKET_ORDER, "form": form})
 
     implied_probability = 1 / odds
     is_value_bet = probability > implied_probability
@@ -70,9 +80,8 @@ async def post_calcola_form(
     else:
         advantage_judgment = "⚠ Nessun vantaggio significativo"
 
-    fractions = [(1/8, "1/8"), (1/10, "1/10"), (1/15, "1/15"), (1/20, "1/20")]
     fraction_lines = []
-    for frac_value, frac_label in fractions:
+    for frac_value, frac_label in KELLY_FRACTIONS:
         bet_amount = kelly_percentage * bankroll * frac_value
         bet_amount_rounded = round_to_nearest_five_cents(bet_amount)
         bet_percentage = (bet_amount_rounded / bankroll) * 100
@@ -99,6 +108,7 @@ async def post_calcola_form(
         advantage_judgment=advantage_judgment,
         fraction_lines=fraction_lines,
         expected_profit_percentage=expected_profit_percentage,
+        calibration=calibration,
     )
 
-    return templates.TemplateResponse("calcola.html", {"request": request, "results": results.dict()}) 
\ No newline at end of file
+    return templates.TemplateResponse("calcola.html", {"request": request, "results": results.dict(), "markets": MARKET_ORDER, "form": form}) 
\ No newline at end of file
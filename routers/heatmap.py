@@ -1,34 +1,23 @@
-from fastapi import APIRouter, Request, File, UploadFile, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+from fastapi import APIRouter, Request, File, UploadFile, Form, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 import pandas as pd
-import io
+import json
 from datetime import datetime, timedelta
+from typing import List
 import numpy as np
 
+from starlette.concurrency import run_in_threadpool
+
+from utils.calibration import update_calibration_index
+from utils.export import EXPORT_CHUNK_ROWS, EXPORT_MEDIA_TYPES, spool_upload, serialize_frame, csv_header
+from utils.jobs import job_queue, get_client_id, JobLimitExceeded
+from utils.ledger import read_ledger, parse_ledgers, merge_ledgers, iter_ledger, to_number, DATE_FORMAT
+from utils.markets import (get_market_from_title, bucket_odds, odds_labels, check_odds_quantiles,
+                           parse_odds_edges, quantile_odds_edges,
+                           MARKET_ORDER, ODDS_EDGES, ODDS_ORDER)
+from utils.templating import templates, stream_template
+
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
-
-def get_market_from_title(title):
-    if pd.isna(title): return "Altro"
-    title_lower = str(title).lower()
-    if any(keyword in title_lower for keyword in ['under', 'over', 'o/u']): return 'Over/Under'
-    if any(keyword in title_lower for keyword in ['1x2', '1)', '2)', 'x)', '(1x)', '(x2)', 'x2', '1x']): return '1X2'
-    if any(keyword in title_lower for keyword in ['entrambe', 'segnano', 'gg', 'both teams', 'btts']): return 'Entrambe segnano'
-    if any(keyword in title_lower for keyword in ['handicap', 'spread', 'asian']): return 'Handicap'
-    if any(keyword in title_lower for keyword in ['corner', 'angolo', 'calcio d\'angolo']): return 'Corner'
-    if any(keyword in title_lower for keyword in ['card', 'cartell', 'ammonizio']): return 'Cartellini'
-    return 'Altro'
-
-def get_odds_range(odds):
-    if pd.isna(odds): return "N/A"
-    odds = float(odds)
-    if odds < 1.5: return "< 1.5"
-    if odds < 1.8: return "1.5-1.8"
-    if odds < 2.5: return "1.8-2.5"
-    if odds < 3.5: return "2.5-3.5"
-    if odds < 5.0: return "3.5-5.0"
-    return "5.0+"
 
 def get_performance_note(roi, sample_size):
     if sample_size < 5: return "Campione insufficiente"
@@ -42,32 +31,62 @@ def get_performance_note(roi, sample_size):
     if roi > -5: return f"Marginale{note_suffix}"
     return f"Poco efficace{note_suffix}"
 
-def transform_csv_to_heatmap_data(df: pd.DataFrame):
-    # Clean column names
-    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
-    
-    # Calculate profit if not present
-    if 'Profitto' not in df.columns or df['Profitto'].isnull().all():
-        df['Puntata'] = pd.to_numeric(df['Puntata'].astype(str).str.replace(',', '.'), errors='coerce')
-        df['Quote'] = pd.to_numeric(df['Quote'].astype(str).str.replace(',', '.'), errors='coerce')
-        df['Profitto'] = np.where(df['Stato'] == 'Vinto', (df['Puntata'] * df['Quote']) - df['Puntata'], -df['Puntata'])
-        df.loc[df['Stato'] == 'Nullo', 'Profitto'] = 0
-
-    grouped_data = {}
-    for _, row in df.iterrows():
-        market = get_market_from_title(row['Titolo_della_scommessa'])
-        odds_range = get_odds_range(row['Quote'])
-        key = (market, odds_range)
-        
-        if key not in grouped_data:
-            grouped_data[key] = {'wins': 0, 'total': 0, 'total_bet': 0, 'total_profit': 0}
-        
-        grouped_data[key]['total'] += 1
-        grouped_data[key]['total_bet'] += row['Puntata']
-        grouped_data[key]['total_profit'] += row['Profitto']
-        if row['Stato'] == 'Vinto':
-            grouped_data[key]['wins'] += 1
-    
+def choose_odds_edges(odds, odds_edges=None, odds_quantiles=0):
+    """Bucket edges for a heatmap: the user's edges, equal-frequency bins of `odds`, or the defaults."""
+    if odds_edges:
+        return tuple(odds_edges)
+    if odds_quantiles:
+        return quantile_odds_edges(odds, odds_quantiles)
+    return ODDS_EDGES
+
+def aggregate_heatmap_cells(titles, odds, stake, profit, won, edges=ODDS_EDGES):
+    """
+    Totali per cella (mercato, fascia di quota) di un blocco di scommesse.
+
+    Il mercato è ricavato una volta per titolo distinto e le fasce con un solo `pd.cut`.
+    """
+    buckets, _ = bucket_odds(odds, edges)
+    return pd.DataFrame({
+        'market': titles.map({title: get_market_from_title(title) for title in titles.unique()}),
+        'odds_range': buckets,
+        'won': won.astype(int),
+        'stake': stake,
+        'profit': profit,
+    }).groupby(['market', 'odds_range'], observed=True).agg(
+        wins=('won', 'sum'), total=('won', 'size'), total_bet=('stake', 'sum'), total_profit=('profit', 'sum'))
+
+def add_heatmap_cells(grouped_data, cells):
+    """Add the totals of `aggregate_heatmap_cells` to the running per-cell totals."""
+    for key, row in cells.iterrows():
+        stats = grouped_data.setdefault(key, {'wins': 0, 'total': 0, 'total_bet': 0, 'total_profit': 0})
+        stats['wins'] += int(row['wins'])
+        stats['total'] += int(row['total'])
+        stats['total_bet'] += float(row['total_bet'])
+        stats['total_profit'] += float(row['total_profit'])
+    return grouped_data
+
+def settled_profit(profit, won, stake, odds):
+    """Use the exported profit, or derive it from outcome, stake and odds when the column is empty."""
+    if profit is None or profit.isnull().all():
+        return pd.Series(np.where(won, stake * odds - stake, -stake), index=stake.index)
+    return profit
+
+def transform_csv_to_heatmap_data(df: pd.DataFrame, edges=ODDS_EDGES):
+    # Accept both the export column names and the cleaned ones ('Titolo_della_scommessa')
+    columns = {col.strip().replace(' ', '_'): col for col in df.columns}
+    stake = to_number(df[columns['Puntata']])
+    odds = to_number(df[columns['Quote']])
+    won = df[columns['Stato']] == 'Vinto'
+    profit = to_number(df[columns['Profitto']]) if 'Profitto' in columns else None
+    profit = settled_profit(profit, won, stake, odds)
+
+    cells = aggregate_heatmap_cells(df[columns['Titolo_della_scommessa']], odds, stake, profit, won, edges)
+    odds_order = odds_labels(edges)
+    heatmap_data = build_heatmap_rows(add_heatmap_cells({}, cells), odds_order)
+    return heatmap_data, list(MARKET_ORDER), odds_order
+
+def build_heatmap_rows(grouped_data, odds_order=ODDS_ORDER):
+    """Turn the per-cell totals into table rows, sorted by market and odds range."""
     heatmap_data = []
     for (market, odds_range), stats in grouped_data.items():
         if stats['total'] == 0: continue
@@ -76,18 +95,139 @@ def transform_csv_to_heatmap_data(df: pd.DataFrame):
         note = get_performance_note(roi, stats['total'])
         heatmap_data.append([market, odds_range, f"{win_rate:.1f}%", f"{roi:+.1f}%", note, str(stats['total'])])
 
-    market_order = ['1X2', 'Over/Under', 'Entrambe segnano', 'Handicap', 'Corner', 'Cartellini', 'Altro']
-    odds_order = ['< 1.5', '1.5-1.8', '1.8-2.5', '2.5-3.5', '3.5-5.0', '5.0+']
-    
     def sort_key(item):
         market, odds_range = item[0], item[1]
-        market_idx = market_order.index(market) if market in market_order else len(market_order)
+        market_idx = MARKET_ORDER.index(market) if market in MARKET_ORDER else len(MARKET_ORDER)
         odds_idx = odds_order.index(odds_range) if odds_range in odds_order else len(odds_order)
         return (market_idx, odds_idx)
     
     heatmap_data.sort(key=sort_key)
-    
-    return heatmap_data, market_order, odds_order
+    return heatmap_data
+
+HEATMAP_COLUMNS = ['Market', 'OddsRange', 'WinRate', 'ROI', 'Note', 'Total']
+
+def period_cutoff(period):
+    """Cutoff date of a period ('all', '7days', '30days', ...); raises ValueError for any other value."""
+    if period == 'all':
+        return None
+    days = period[:-len('days')] if period.endswith('days') else ''
+    if not days.isdigit() or int(days) == 0:
+        raise ValueError(f"Periodo non valido: '{period}'. Usa 'all' oppure ad esempio '30days'.")
+    return datetime.now() - timedelta(days=int(days))
+
+def settled_chunks(source, cutoff_date=None, progress=None):
+    """Blocks of settled bets (won or lost) of the ledger, placed after `cutoff_date` if given."""
+    for chunk in iter_ledger(source, EXPORT_CHUNK_ROWS):
+        if progress is not None:
+            progress(len(chunk))
+        chunk = chunk[chunk['Stato'].isin(['Vinto', 'Perso'])]
+        if cutoff_date is not None:
+            chunk = chunk[pd.to_datetime(chunk['Data'], format=DATE_FORMAT, errors='coerce') > cutoff_date]
+        if len(chunk):
+            yield chunk
+
+def iter_heatmap_cells(source, fmt, period="all", odds_edges=None, odds_quantiles=0):
+    """
+    Genera le celle della heatmap come CSV o NDJSON leggendo il ledger a blocchi.
+
+    In memoria restano solo i totali per cella, qualunque sia il numero di righe.
+    Con le fasce a quantili una prima lettura raccoglie solo le quote.
+
+    Le celle sono note solo dopo aver letto tutto il ledger: in NDJSON le precede
+    una riga {"rows_read": N} per ogni blocco letto, così il client riceve subito
+    dati e può mostrare l'avanzamento. Il CSV contiene solo intestazione e celle.
+    """
+    cutoff_date = period_cutoff(period)
+    rows_read = [0]
+    progress_lines = []
+
+    def progress(rows):
+        rows_read[0] += rows
+        if fmt == "ndjson":
+            progress_lines.append(json.dumps({"rows_read": rows_read[0]}) + "\n")
+
+    def flush_progress():
+        text = "".join(progress_lines)
+        progress_lines.clear()
+        return text
+
+    try:
+        if fmt == "csv":
+            yield csv_header(HEATMAP_COLUMNS)
+        else:
+            yield json.dumps({"rows_read": 0}) + "\n"
+
+        odds = None
+        if odds_quantiles and not odds_edges:
+            odds = np.concatenate([to_number(chunk['Quote']).to_numpy() for chunk in settled_chunks(source, cutoff_date)]
+                                  or [np.empty(0)])
+            source.seek(0)
+        edges = choose_odds_edges(odds, odds_edges, odds_quantiles)
+
+        grouped_data = {}
+        for chunk in settled_chunks(source, cutoff_date, progress):
+            if progress_lines:
+                yield flush_progress()
+            stake = to_number(chunk['Puntata'])
+            odds = to_number(chunk['Quote'])
+            won = chunk['Stato'] == 'Vinto'
+            profit = to_number(chunk['Profitto']) if 'Profitto' in chunk.columns else None
+            profit = settled_profit(profit, won, stake, odds)
+            add_heatmap_cells(grouped_data, aggregate_heatmap_cells(
+                chunk['Titolo della scommessa'], odds, stake, profit, won, edges))
+
+        rows = pd.DataFrame(build_heatmap_rows(grouped_data, odds_labels(edges)), columns=HEATMAP_COLUMNS)
+        yield flush_progress() + serialize_frame(rows, fmt)
+    finally:
+        source.close()
+
+def run_heatmap(contents, filenames, period="all", odds_edges=None, odds_quantiles=0, progress=None):
+    """
+    Parse one or more uploaded ledgers and return the heatmap results for the selected period.
+
+    Several files are parsed in parallel and merged, dropping bets present in more than one export.
+    Odds buckets are the defaults, `odds_edges` if given, or `odds_quantiles` equal-frequency bins.
+    """
+    if len(contents) == 1:
+        df = read_ledger(contents[0], progress=progress)
+        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y %H:%M', errors='coerce')
+        duplicates = 0
+    else:
+        df, duplicates = merge_ledgers(parse_ledgers(contents, progress=progress))
+    update_calibration_index(df)
+
+    cutoff_date = period_cutoff(period)
+    if cutoff_date is not None:
+        df = df[df['Data'] > cutoff_date]
+
+    df = df[df['Stato'].isin(['Vinto', 'Perso'])]
+
+    results = {
+        "filename": ", ".join(filenames),
+        "period": period,
+        "num_rows": len(df),
+        "duplicates_removed": duplicates,
+    }
+    if len(df) == 0:
+        return results
+
+    edges = choose_odds_edges(to_number(df['Quote']), odds_edges, odds_quantiles)
+    heatmap_data, markets, odds_ranges = transform_csv_to_heatmap_data(df, edges)
+
+    # Pivot data for table display
+    pivot_df = pd.DataFrame(heatmap_data, columns=HEATMAP_COLUMNS)
+    heatmap_table = pivot_df.pivot(index='Market', columns='OddsRange', values='ROI').reindex(index=markets, columns=odds_ranges)
+    # Empty cells become None so the template (and the JSON job results) see a missing value, not NaN
+    heatmap_table = heatmap_table.astype(object).where(heatmap_table.notna(), None)
+
+    results.update({
+        "heatmap_table": heatmap_table.to_dict(orient='index'),
+        "markets": markets,
+        "odds_ranges": odds_ranges,
+        "odds_edges": list(edges),
+        "raw_data": pivot_df.to_dict(orient='records')
+    })
+    return results
 
 @router.get("/heatmap", response_class=HTMLResponse)
 async def get_heatmap_form(request: Request):
@@ -96,41 +236,69 @@ async def get_heatmap_form(request: Request):
 @router.post("/heatmap", response_class=HTMLResponse)
 async def post_heatmap_form(
     request: Request, 
-    csv_file: UploadFile = File(...),
-    period: str = Form("all")
+    csv_file: List[UploadFile] = File(...),
+    period: str = Form("all"),
+    odds_edges: str = Form(""),
+    odds_quantiles: int = Form(0)
 ):
     try:
-        content = await csv_file.read()
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')), sep=';')
-        
-        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y %H:%M', errors='coerce')
-
-        if period != 'all':
-            days = int(period.replace('days',''))
-            cutoff_date = datetime.now() - timedelta(days=days)
-            df = df[df['Data'] > cutoff_date]
-        
-        df = df[df['Stato'].isin(['Vinto', 'Perso'])]
-        
-        if len(df) == 0:
+        edges = parse_odds_edges(odds_edges)
+        contents = [await upload.read() for upload in csv_file]
+        results = run_heatmap(contents, [upload.filename for upload in csv_file], period,
+                              edges, check_odds_quantiles(odds_quantiles))
+        if results["num_rows"] == 0:
             return templates.TemplateResponse("heatmap.html", {"request": request, "error": "Nessuna scommessa trovata per il periodo selezionato."})
 
-        heatmap_data, markets, odds_ranges = transform_csv_to_heatmap_data(df)
-
-        # Pivot data for table display
-        pivot_df = pd.DataFrame(heatmap_data, columns=['Market', 'OddsRange', 'WinRate', 'ROI', 'Note', 'Total'])
-        heatmap_table = pivot_df.pivot(index='Market', columns='OddsRange', values='ROI').reindex(index=markets, columns=odds_ranges)
-        
-        results = {
-            "filename": csv_file.filename,
-            "period": period,
-            "num_rows": len(df),
-            "heatmap_table": heatmap_table.to_dict(orient='index'),
-            "markets": markets,
-            "odds_ranges": odds_ranges,
-            "raw_data": pivot_df.to_dict(orient='records')
-        }
-
-        return templates.TemplateResponse("heatmap.html", {"request": request, "results": results})
+        # Result tables can be large: render them as a stream instead of one string
+        return stream_template("heatmap.html", {"request": request, "results": results})
     except Exception as e:
-        return templates.TemplateResponse("heatmap.html", {"request": request, "error": f"An error occurred: {str(e)}"}) 
\ No newline at end of file
+        return templates.TemplateResponse("heatmap.html", {"request": request, "error": f"An error occurred: {str(e)}"}) 
+
+@router.post("/heatmap/jobs")
+async def post_heatmap_job(
+    request: Request,
+    csv_file: List[UploadFile] = File(...),
+    period: str = Form("all"),
+    odds_edges: str = Form(""),
+    odds_quantiles: int = Form(0)
+):
+    """Build the heatmap in the background and return the job id immediately."""
+    try:
+        edges = parse_odds_edges(odds_edges)
+        check_odds_quantiles(odds_quantiles)
+        period_cutoff(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    contents = [await upload.read() for upload in csv_file]
+    try:
+        job_id = job_queue.submit(get_client_id(request), "heatmap", run_heatmap,
+                                  contents, [upload.filename for upload in csv_file], period, edges, odds_quantiles)
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+
+@router.post("/heatmap/export")
+async def post_heatmap_export(
+    csv_file: UploadFile = File(...),
+    period: str = Form("all"),
+    odds_edges: str = Form(""),
+    odds_quantiles: int = Form(0),
+    fmt: str = Form("csv", alias="format")
+):
+    """Stream the heatmap cells of the uploaded ledger as CSV or NDJSON."""
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Formato non supportato: usa 'csv' o 'ndjson'.")
+    try:
+        edges = parse_odds_edges(odds_edges)
+        check_odds_quantiles(odds_quantiles)
+        # Checked here: once streaming starts the 200 status is already sent
+        period_cutoff(period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    source = await run_in_threadpool(spool_upload, csv_file.file)
+    return StreamingResponse(
+        iter_heatmap_cells(source, fmt, period, edges, odds_quantiles),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="heatmap.{fmt}"'},
+    )
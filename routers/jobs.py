@@ -0,0 +1,64 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+
+from utils.jobs import job_queue, DONE, FAILED
+
+router = APIRouter()
+
+# Seconds between two progress events sent to a subscribed client
+EVENTS_POLL_INTERVAL = 0.5
+
+def job_status(job):
+    """Public view of a job, without the (possibly large) result."""
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "rows_processed": job["rows_processed"],
+        "error": job["error"],
+        "result_url": f"/jobs/{job['id']}/result" if job["status"] == DONE else None,
+    }
+
+def get_job_or_404(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato o scaduto.")
+    return job
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_status(get_job_or_404(job_id))
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """Server-Sent Events stream with the job progress, closed when the job finishes."""
+    get_job_or_404(job_id)
+
+    async def event_stream():
+        last_event = None
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                yield f"event: expired\ndata: {json.dumps({'job_id': job_id})}\n\n"
+                return
+            event = job_status(job)
+            if event != last_event:
+                yield f"data: {json.dumps(event)}\n\n"
+                last_event = event
+            if job["status"] in (DONE, FAILED):
+                return
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != DONE:
+        return JSONResponse(status_code=409, content=job_status(job))
+    return job["result"]
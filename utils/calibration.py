@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from utils.ledger import bet_hashes, to_number
+from utils.markets import get_market_from_title, get_odds_range, bucket_odds
+
+logger = logging.getLogger(__name__)
+
+# Weight of the implied-odds prior, in bets: a cell with this many bets is
+# trusted half as its own win rate and half as the bookmaker's implied probability
+PRIOR_STRENGTH = 30
+
+class CalibrationIndex:
+    """
+    Indice di calibrazione storica per cella (mercato, fascia di quota).
+
+    Ogni cella conserva contatori additivi (vinte, totale, somma delle probabilità
+    implicite, deriva rispetto alle Closing Odds), quindi può essere aggiornata
+    in modo incrementale e interrogata in O(1).
+
+    Celle e hash delle scommesse già viste stanno in un database SQLite (in memoria
+    se `path` è None): ogni caricamento scrive solo i propri incrementi in una
+    transazione, così più worker possono aggiornare lo stesso file senza perdere dati.
+    """
+
+    def __init__(self, path=None, prior_strength=PRIOR_STRENGTH):
+        self.path = path
+        self.prior_strength = prior_strength
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path or ":memory:", timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS calibration_cells (
+                market TEXT NOT NULL,
+                odds_range TEXT NOT NULL,
+                wins INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                implied_sum REAL NOT NULL,
+                drift_sum REAL NOT NULL,
+                drift_count INTEGER NOT NULL,
+                PRIMARY KEY (market, odds_range)
+            )
+        ''')
+        self.conn.execute("CREATE TABLE IF NOT EXISTS calibration_seen (hash INTEGER PRIMARY KEY)")
+        self.conn.execute("CREATE TEMP TABLE calibration_batch (hash INTEGER NOT NULL)")
+
+    @classmethod
+    def load(cls, path, prior_strength=PRIOR_STRENGTH):
+        """Open the index saved at `path`, importing it once if it is in the old JSON format."""
+        legacy = None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                is_sqlite = f.read(16) == b"SQLite format 3\x00"
+            if not is_sqlite:
+                with open(path, encoding="utf-8") as f:
+                    legacy = json.load(f)
+                os.replace(path, f"{path}.bak")
+        index = cls(path, prior_strength)
+        if legacy is not None:
+            index._import(legacy)
+        if path:
+            cells, bets = index.conn.execute(
+                "SELECT (SELECT COUNT(*) FROM calibration_cells), (SELECT COUNT(*) FROM calibration_seen)"
+            ).fetchone()
+            logger.info(f"Calibration index loaded: {cells} cells, {bets} bets")
+        return index
+
+    def _import(self, data):
+        """Copy the cells and hashes of an index saved by the old JSON format."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._add_cells([
+                    (cell["market"], cell["odds_range"], cell["wins"], cell["total"],
+                     cell["implied_sum"], cell["drift_sum"], cell["drift_count"])
+                    for cell in data["cells"]
+                ])
+                hashes = np.array(data["seen"], dtype=np.uint64).view(np.int64)
+                self.conn.executemany("INSERT OR IGNORE INTO calibration_seen (hash) VALUES (?)",
+                                      ((int(h),) for h in hashes))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _add_cells(self, rows):
+        self.conn.executemany('''
+            INSERT INTO calibration_cells (market, odds_range, wins, total, implied_sum, drift_sum, drift_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (market, odds_range) DO UPDATE SET
+                wins = wins + excluded.wins,
+                total = total + excluded.total,
+                implied_sum = implied_sum + excluded.implied_sum,
+                drift_sum = drift_sum + excluded.drift_sum,
+                drift_count = drift_count + excluded.drift_count
+        ''', rows)
+
+    def update(self, df: pd.DataFrame):
+        """
+        Aggiunge all'indice le scommesse chiuse (Vinto/Perso) non ancora viste.
+
+        Args:
+            df (pd.DataFrame): Ledger con i nomi di colonna originali dell'export.
+
+        Returns:
+            int: Numero di scommesse aggiunte.
+        """
+        settled = df[df['Stato'].isin(['Vinto', 'Perso'])]
+        if len(settled) == 0:
+            return 0
+
+        # SQLite integers are signed: store the same 64 bits as int64
+        hashes = bet_hashes(settled).astype(np.uint64).view(np.int64)
+        # The write lock is held from the lookup to the commit, so two uploads
+        # of the same bets cannot both count them, even from different workers
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = self._add_new(settled, hashes)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return added
+
+    def _add_new(self, settled, hashes):
+        self.conn.execute("DELETE FROM calibration_batch")
+        self.conn.executemany("INSERT INTO calibration_batch (hash) VALUES (?)", ((int(h),) for h in hashes))
+        known = np.fromiter(
+            (h for (h,) in self.conn.execute(
+                "SELECT DISTINCT hash FROM calibration_batch JOIN calibration_seen USING (hash)")),
+            dtype=np.int64,
+        )
+        is_new = ~np.isin(hashes, known)
+        settled = settled[is_new]
+        if len(settled) == 0:
+            return 0
+
+        odds = to_number(settled['Quote'])
+        titles = settled['Titolo della scommessa']
+        markets = titles.map({title: get_market_from_title(title) for title in titles.unique()})
+        if 'Closing Odds' in settled.columns:
+            closing = to_number(settled['Closing Odds'])
+        else:
+            closing = pd.Series(np.nan, index=settled.index)
+        drift = (odds / closing.where(closing > 1)) - 1
+
+        batch = pd.DataFrame({
+            'market': markets,
+            'odds_range': bucket_odds(odds)[0],
+            'win': (settled['Stato'] == 'Vinto').astype(int),
+            'implied': 1 / odds.where(odds > 1),
+            'drift': drift,
+        })
+        batch = batch[batch['implied'].notna()]
+        grouped = batch.groupby(['market', 'odds_range'], observed=True).agg(
+            wins=('win', 'sum'),
+            total=('win', 'size'),
+            implied_sum=('implied', 'sum'),
+            drift_sum=('drift', 'sum'),
+            drift_count=('drift', 'count'),
+        )
+
+        self._add_cells([
+            (market, odds_range, int(row['wins']), int(row['total']), float(row['implied_sum']),
+             float(row['drift_sum']), int(row['drift_count']))
+            for (market, odds_range), row in grouped.iterrows()
+        ])
+        self.conn.execute("INSERT OR IGNORE INTO calibration_seen (hash) SELECT hash FROM calibration_batch")
+        return len(settled)
+
+    def suggest(self, market, odds):
+        """
+        Suggerisce una probabilità di vincita per una quota in un mercato.
+
+        La win rate della cella è ristretta verso la probabilità implicita media
+        (peso `prior_strength`), e il rapporto fra le due corregge la probabilità
+        implicita della quota richiesta.
+
+        Returns:
+            dict | None: Probabilità suggerita e statistiche della cella, o None se la cella è vuota.
+        """
+        odds_range = get_odds_range(odds)
+        with self._lock:
+            row = self.conn.execute('''
+                SELECT wins, total, implied_sum, drift_sum, drift_count
+                FROM calibration_cells WHERE market = ? AND odds_range = ?
+            ''', (market, odds_range)).fetchone()
+        if row is None or odds <= 1:
+            return None
+        cell = dict(zip(["wins", "total", "implied_sum", "drift_sum", "drift_count"], row))
+        if cell["total"] == 0:
+            return None
+
+        prior = cell["implied_sum"] / cell["total"]
+        shrunk_win_rate = (cell["wins"] + self.prior_strength * prior) / (cell["total"] + self.prior_strength)
+        probability = min(max(shrunk_win_rate / prior / odds, 0.01), 0.99)
+        closing_drift = cell["drift_sum"] / cell["drift_count"] if cell["drift_count"] else None
+        return {
+            "market": market,
+            "odds_range": odds_range,
+            "probability": probability,
+            "sample_size": cell["total"],
+            "observed_win_rate": cell["wins"] / cell["total"],
+            "shrunk_win_rate": shrunk_win_rate,
+            "closing_drift": closing_drift,
+        }
+
+def update_calibration_index(df: pd.DataFrame):
+    """Feed newly uploaded bets to the shared index; errors never break the upload."""
+    try:
+        calibration_index.update(df)
+    except Exception as e:
+        logger.error(f"Error updating calibration index: {e}", exc_info=True)
+
+calibration_index = CalibrationIndex.load(os.environ.get("CALIBRATION_INDEX_PATH"))
@@ -1,8 +1,21 @@
 import sqlite3
 import logging
 
+from utils.instrumentation import timed_db_call
+
 logger = logging.getLogger(__name__)
 
+UPDATED_BANKROLL_DESCRIPTION = "Bankroll iniziale aggiornato"
+
+# Bankroll change of a settled event row `{e}`, used by the history replay
+EVENT_DELTA_SQL = """
+    CASE
+        WHEN {e}.return_value IS NOT NULL THEN {e}.return_value - {e}.bet_amount
+        WHEN {e}.outcome = 1 THEN {e}.bet_amount * ({e}.odds - 1)
+        ELSE -{e}.bet_amount
+    END
+"""
+
 class Database:
     def __init__(self, db_path):
         self.db_path = db_path
@@ -57,12 +70,23 @@ class Database:
                 )
             ''')
 
+            # Per-user lookups in timestamp order (history and bankroll replay)
+            self.cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_events_user_timestamp
+                ON events (user_id, chat_id, timestamp)
+            ''')
+            self.cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_bankroll_history_user_timestamp
+                ON bankroll_history (user_id, chat_id, timestamp)
+            ''')
+
             self.conn.commit()
             logger.info("Tables created successfully")
         except sqlite3.Error as e:
             logger.error(f"Error creating tables: {e}")
             raise
 
+    @timed_db_call
     def insert_event(self, user_id, chat_id, odds, probability, bankroll, kelly_percentage, fraction_label, bet_amount, event_name):
         """Insert a new event into the database."""
         try:
@@ -76,8 +100,14 @@ class Database:
             logger.error(f"Error inserting event: {e}")
             raise
 
-    def update_event_outcome(self, event_id, outcome, return_value):
-        """Update the outcome of an event."""
+    @timed_db_call
+    def update_event_outcome(self, event_id, outcome, return_value, replay_history=False):
+        """
+        Update the outcome of an event.
+
+        With replay_history=True the owner's bankroll history is rebuilt from the events table;
+        callers that record the settlement themselves with update_bankroll must leave it off.
+        """
         try:
             self.cursor.execute('''
                 UPDATE events
@@ -89,7 +119,25 @@ class Database:
         except sqlite3.Error as e:
             logger.error(f"Error updating event outcome: {e}")
             raise
+        if replay_history:
+            owner = self.get_event_owner(event_id)
+            if owner:
+                self.replay_bankroll_history(*owner)
 
+    @timed_db_call
+    def get_event_owner(self, event_id):
+        """Get the (user_id, chat_id) pair of an event."""
+        try:
+            self.cursor.execute('''
+                SELECT user_id, chat_id FROM events
+                WHERE event_id = ?
+            ''', (event_id,))
+            return self.cursor.fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error getting event owner: {e}")
+            raise
+
+    @timed_db_call
     def get_events(self, user_id, chat_id):
         """Get all events for a user in a chat."""
         try:
@@ -105,6 +153,7 @@ class Database:
             logger.error(f"Error getting events: {e}")
             raise
 
+    @timed_db_call
     def get_event_odds(self, event_id):
         """Get the odds for a specific event."""
         try:
@@ -118,6 +167,7 @@ class Database:
             logger.error(f"Error getting event odds: {e}")
             raise
 
+    @timed_db_call
     def update_bankroll(self, user_id, chat_id, new_bankroll, event_id=None, description=None):
         """Update the bankroll for a user in a chat."""
         try:
@@ -131,13 +181,14 @@ class Database:
             logger.error(f"Error updating bankroll: {e}")
             raise
 
+    @timed_db_call
     def get_current_bankroll(self, user_id, chat_id):
         """Get the current bankroll for a user in a chat."""
         try:
             self.cursor.execute('''
                 SELECT bankroll FROM bankroll_history
                 WHERE user_id = ? AND chat_id = ?
-                ORDER BY timestamp DESC
+                ORDER BY timestamp DESC, id DESC
                 LIMIT 1
             ''', (user_id, chat_id))
             result = self.cursor.fetchone()
@@ -146,13 +197,14 @@ class Database:
             logger.error(f"Error getting current bankroll: {e}")
             raise
 
+    @timed_db_call
     def get_initial_bankroll(self, user_id, chat_id):
         """Get the initial bankroll for a user in a chat."""
         try:
             self.cursor.execute('''
                 SELECT bankroll FROM bankroll_history
                 WHERE user_id = ? AND chat_id = ?
-                ORDER BY timestamp ASC
+                ORDER BY timestamp ASC, id ASC
                 LIMIT 1
             ''', (user_id, chat_id))
             result = self.cursor.fetchone()
@@ -161,6 +213,7 @@ class Database:
             logger.error(f"Error getting initial bankroll: {e}")
             raise
 
+    @timed_db_call
     def update_initial_bankroll(self, user_id, chat_id, new_bankroll):
         """Update the initial bankroll for a user in a chat."""
         try:
@@ -188,7 +241,7 @@ class Database:
                         ORDER BY timestamp DESC
                         LIMIT 1
                     )
-                ''', (new_bankroll, "Bankroll iniziale aggiornato", user_id, chat_id))
+                ''', (new_bankroll, UPDATED_BANKROLL_DESCRIPTION, user_id, chat_id))
 
             self.conn.commit()
             logger.info(f"Initial bankroll updated successfully for user {user_id}")
@@ -196,15 +249,17 @@ class Database:
             logger.error(f"Error updating initial bankroll: {e}")
             raise
 
-    def delete_event(self, event_id):
-        """Delete an event from the database."""
+    @timed_db_call
+    def delete_event(self, event_id, replay_history=False):
+        """Delete an event from the database, optionally rebuilding the owner's bankroll history."""
         try:
             # First, check if the event exists
             self.cursor.execute('''
-                SELECT event_id FROM events
+                SELECT user_id, chat_id FROM events
                 WHERE event_id = ?
             ''', (event_id,))
-            if not self.cursor.fetchone():
+            owner = self.cursor.fetchone()
+            if not owner:
                 logger.error(f"Event {event_id} not found")
                 return False
 
@@ -216,10 +271,132 @@ class Database:
             
             self.conn.commit()
             logger.info(f"Event {event_id} deleted successfully")
-            return True
         except sqlite3.Error as e:
             logger.error(f"Error deleting event: {e}")
             return False
+        if replay_history:
+            self.replay_bankroll_history(*owner)
+        return True
+
+    @timed_db_call
+    def replay_bankroll_history(self, user_id, chat_id):
+        """
+        Rebuild the bankroll history of a user in a chat from the events table.
+
+        Every settled event (outcome not NULL) changes the bankroll by
+        return_value - bet_amount; when return_value is missing, a won event
+        (outcome 1) pays bet_amount * (odds - 1) and any other outcome loses the stake.
+        Rows not tied to an event (initial bankroll, deposits, withdrawals) and rows
+        edited by update_initial_bankroll are kept as adjustments: each contributes
+        the change it recorded over the previous row. Adjustments and events are
+        summed in timestamp order with a single window SUM inside SQLite; the
+        event rows are replaced and the adjustment rows get the corrected balance,
+        all in one transaction.
+
+        Returns:
+            float | None: The replayed current bankroll, or None if there is no history.
+        """
+        try:
+            self.cursor.execute('''
+                SELECT timestamp FROM bankroll_history
+                WHERE user_id = ? AND chat_id = ?
+                ORDER BY timestamp ASC, id ASC
+                LIMIT 1
+            ''', (user_id, chat_id))
+            first = self.cursor.fetchone()
+            if first is None:
+                logger.error(f"No bankroll history to replay for user {user_id}")
+                return None
+            first_timestamp = first[0]
+
+            self.cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS replay_adjustments (id INTEGER PRIMARY KEY, delta REAL NOT NULL)
+            ''')
+            self.cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS replay_balances (
+                    kind INTEGER NOT NULL, ref INTEGER NOT NULL, timestamp DATETIME, bankroll REAL NOT NULL,
+                    description TEXT
+                )
+            ''')
+            self.cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS replay_descriptions (event_id INTEGER PRIMARY KEY, description TEXT)
+            ''')
+            self.cursor.execute("DELETE FROM replay_adjustments")
+            self.cursor.execute("DELETE FROM replay_descriptions")
+            self.cursor.execute("DELETE FROM replay_balances")
+
+            # Change recorded by each manual row over the previous row; an edited event row
+            # (or an event row that opens the history) keeps only the part not due to its event
+            self.cursor.execute(f'''
+                INSERT INTO replay_adjustments (id, delta)
+                SELECT history.id, history.delta - COALESCE({EVENT_DELTA_SQL.format(e="e")}, 0)
+                FROM (
+                    SELECT id, event_id, description,
+                           bankroll - COALESCE(LAG(bankroll) OVER (ORDER BY timestamp, id), 0) AS delta,
+                           ROW_NUMBER() OVER (ORDER BY timestamp, id) AS position
+                    FROM bankroll_history
+                    WHERE user_id = ? AND chat_id = ?
+                ) AS history
+                LEFT JOIN events e ON e.event_id = history.event_id AND e.outcome IS NOT NULL
+                WHERE history.event_id IS NULL OR history.description = ? OR history.position = 1
+            ''', (user_id, chat_id, UPDATED_BANKROLL_DESCRIPTION))
+
+            # Replayed event rows keep the description the caller wrote, if any
+            self.cursor.execute('''
+                INSERT INTO replay_descriptions (event_id, description)
+                SELECT event_id, description
+                FROM (
+                    SELECT event_id, description,
+                           ROW_NUMBER() OVER (PARTITION BY event_id ORDER BY timestamp DESC, id DESC) AS position
+                    FROM bankroll_history
+                    WHERE user_id = ? AND chat_id = ? AND event_id IS NOT NULL
+                          AND id NOT IN (SELECT id FROM replay_adjustments)
+                )
+                WHERE position = 1
+            ''', (user_id, chat_id))
+
+            # Adjustments keep their ids and replayed event rows get new, larger ones, so
+            # ordering by (timestamp, kind, ref) here matches (timestamp, id) once stored
+            self.cursor.execute(f'''
+                INSERT INTO replay_balances (kind, ref, timestamp, bankroll, description)
+                SELECT kind, ref, timestamp, ROUND(SUM(delta) OVER (ORDER BY timestamp, kind, ref), 2), description
+                FROM (
+                    SELECT 0 AS kind, h.id AS ref, h.timestamp AS timestamp, a.delta AS delta, NULL AS description
+                    FROM replay_adjustments a JOIN bankroll_history h ON h.id = a.id
+                    UNION ALL
+                    SELECT 1, events.event_id, MAX(events.timestamp, ?), {EVENT_DELTA_SQL.format(e="events")},
+                           d.description
+                    FROM events
+                    LEFT JOIN replay_descriptions d ON d.event_id = events.event_id
+                    WHERE events.user_id = ? AND events.chat_id = ? AND events.outcome IS NOT NULL
+                )
+            ''', (first_timestamp, user_id, chat_id))
+
+            self.cursor.execute('''
+                DELETE FROM bankroll_history
+                WHERE user_id = ? AND chat_id = ? AND id NOT IN (SELECT id FROM replay_adjustments)
+            ''', (user_id, chat_id))
+            self.cursor.execute('''
+                UPDATE bankroll_history
+                SET event_id = NULL,
+                    bankroll = (SELECT bankroll FROM replay_balances b WHERE b.kind = 0 AND b.ref = bankroll_history.id)
+                WHERE id IN (SELECT id FROM replay_adjustments)
+            ''')
+            self.cursor.execute('''
+                INSERT INTO bankroll_history (user_id, chat_id, bankroll, event_id, description, timestamp)
+                SELECT ?, ?, bankroll, ref, COALESCE(description, 'Ricalcolo evento #' || ref), timestamp
+                FROM replay_balances
+                WHERE kind = 1
+                ORDER BY timestamp, ref
+            ''', (user_id, chat_id))
+            replayed = self.cursor.rowcount
+            self.conn.commit()
+            logger.info(f"Bankroll history replayed for user {user_id}: {replayed} events")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            logger.error(f"Error replaying bankroll history: {e}")
+            raise
+        return self.get_current_bankroll(user_id, chat_id)
 
     def close(self):
         """Close the database connection."""
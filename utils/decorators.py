@@ -1,21 +1,40 @@
 import logging
+import os
+import time
 from functools import wraps
 from telegram.ext import ConversationHandler
 
+from utils.instrumentation import instrumentation, current_handler, update_type, install_stats_dump
+
 logger = logging.getLogger(__name__)
 
+# Every bot process imports this module, so the stats dump is enabled here
+# when BOT_STATS_PATH is set (see install_stats_dump)
+if os.environ.get("BOT_STATS_PATH"):
+    install_stats_dump()
+
 def handle_errors(error_message, return_state=None):
     def decorator(func):
+        name = func.__name__
+
         @wraps(func)
         async def wrapper(update, context, *args, **kwargs):
+            instrumentation.handler_started(name)
+            token = current_handler.set(name)
+            start = time.perf_counter()
+            error = False
             try:
                 return await func(update, context, *args, **kwargs)
             except Exception as e:
+                error = True
                 logger.error(f"Errore in {func.__name__}: {str(e)}", exc_info=True)
                 if update.message:
                     await update.message.reply_text(error_message)
                 elif update.callback_query:
                     await update.callback_query.message.reply_text(error_message)
                 return return_state if return_state is not None else ConversationHandler.END
+            finally:
+                current_handler.reset(token)
+                instrumentation.handler_finished(name, update_type(update), (time.perf_counter() - start) * 1000, error)
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,36 @@
+import shutil
+import tempfile
+import pandas as pd
+
+# Smaller than the parsing chunk, so the first rows reach the client quickly
+EXPORT_CHUNK_ROWS = 10_000
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def spool_upload(fileobj):
+    """
+    Copia un upload in un file temporaneo a blocchi da 1 MB.
+
+    Lo stream di risposta può così leggere il ledger dopo la chiusura della
+    richiesta senza tenerne in memoria una copia completa.
+    """
+    spooled = tempfile.TemporaryFile()
+    shutil.copyfileobj(fileobj, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
+
+def serialize_frame(frame: pd.DataFrame, fmt, header=False):
+    """Serialize one chunk of rows as CSV (';' separated, like the exports) or NDJSON."""
+    if fmt == "csv":
+        return frame.to_csv(sep=';', index=False, header=header)
+    if len(frame) == 0:
+        return ""
+    text = frame.to_json(orient='records', lines=True, force_ascii=False)
+    return text if text.endswith("\n") else text + "\n"
+
+def csv_header(columns):
+    """Header line sent before the first chunk, so even a slow export answers at once."""
+    return serialize_frame(pd.DataFrame(columns=columns), "csv", header=True)
@@ -3,8 +3,13 @@ import io
 import math
 import csv
 
-def create_performance_heatmap(table_rows):
-    """Crea una heatmap professionale delle performance di scommesse"""
+def create_performance_heatmap(table_rows, odds_order=None):
+    """
+    Crea una heatmap professionale delle performance di scommesse.
+
+    Le colonne sono le fasce di quota presenti nelle righe, nell'ordine di `odds_order`
+    se indicato (es. le etichette di `bucket_odds`), altrimenti in ordine di apparizione.
+    """
     width = 900
     height = 600
     margin = 20
@@ -49,6 +54,9 @@ def create_performance_heatmap(table_rows):
             win_rate_matrix[key] = win_rate
             sample_matrix[key] = sample
 
+    if odds_order is not None:
+        quotes = [quota for quota in odds_order if quota in quotes] + [quota for quota in quotes if quota not in odds_order]
+
     left_margin = 160
     top_margin = 120
     cell_width = (width - left_margin - 120) // len(quotes)
@@ -0,0 +1,188 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BUCKET_LABELS = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+
+# Calls slower than this are logged with the handler name and update type
+SLOW_HANDLER_MS = float(os.environ.get("BOT_SLOW_HANDLER_MS", "1000"))
+
+# Handler currently running in this task, used to attribute database timings
+current_handler = contextvars.ContextVar("current_handler", default=None)
+
+class LatencyStats:
+    """Contatori e istogramma delle latenze di una singola operazione."""
+
+    __slots__ = ("calls", "errors", "in_flight", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, error=False):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        if error:
+            self.errors += 1
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, capped at the slowest call seen."""
+        if self.calls == 0:
+            return None
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(LATENCY_BUCKETS_MS[i], self.max_ms) if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": self.errors / self.calls if self.calls else 0.0,
+            "in_flight": self.in_flight,
+            "mean_ms": self.total_ms / self.calls if self.calls else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "histogram_ms": dict(zip(BUCKET_LABELS, self.buckets)),
+        }
+
+class Instrumentation:
+    """
+    Statistiche in memoria dei handler Telegram e delle query al database.
+
+    I handler sono indicizzati per nome, le query per (handler, metodo) così
+    da sapere quali chiamate al database rallentano ciascuno stato della conversazione.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.handlers = {}
+        self.update_types = {}
+        self.db_calls = {}
+        self.slow_calls = 0
+
+    def handler_started(self, name):
+        with self._lock:
+            stats = self.handlers.get(name)
+            if stats is None:
+                stats = self.handlers[name] = LatencyStats()
+            stats.in_flight += 1
+
+    def handler_finished(self, name, update_type, elapsed_ms, error):
+        with self._lock:
+            stats = self.handlers[name]
+            stats.in_flight -= 1
+            stats.record(elapsed_ms, error)
+            key = (name, update_type)
+            self.update_types[key] = self.update_types.get(key, 0) + 1
+            if elapsed_ms >= SLOW_HANDLER_MS:
+                self.slow_calls += 1
+        if elapsed_ms >= SLOW_HANDLER_MS:
+            logger.warning(f"Handler lento: {name} ({update_type}) ha impiegato {elapsed_ms:.0f} ms")
+
+    def db_call_finished(self, method, elapsed_ms, error):
+        key = (current_handler.get() or "-", method)
+        with self._lock:
+            stats = self.db_calls.get(key)
+            if stats is None:
+                stats = self.db_calls[key] = LatencyStats()
+            stats.record(elapsed_ms, error)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "uptime_s": time.time() - self.started_at,
+                "slow_threshold_ms": SLOW_HANDLER_MS,
+                "slow_calls": self.slow_calls,
+                "handlers": {name: stats.snapshot() for name, stats in self.handlers.items()},
+                "update_types": {f"{name}:{update_type}": count for (name, update_type), count in self.update_types.items()},
+                "db_calls": {f"{handler}:{method}": stats.snapshot() for (handler, method), stats in self.db_calls.items()},
+            }
+
+    def dump(self, path):
+        """Write the current statistics as JSON to `path`."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"Statistiche del bot salvate in {path}")
+
+instrumentation = Instrumentation()
+
+def update_type(update):
+    """Short label of the kind of Telegram update (message, callback_query, ...)."""
+    if getattr(update, "callback_query", None):
+        return "callback_query"
+    if getattr(update, "message", None):
+        message = update.message
+        if getattr(message, "text", None) and message.text.startswith("/"):
+            return "command"
+        return "message"
+    if getattr(update, "inline_query", None):
+        return "inline_query"
+    return "other"
+
+def timed_db_call(func):
+    """Record the latency of a Database method under the handler that invoked it."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            instrumentation.db_call_finished(func.__name__, (time.perf_counter() - start) * 1000, error)
+    return wrapper
+
+_dump_installed = False
+
+def install_stats_dump(path=None):
+    """
+    Salva le statistiche all'uscita del processo e a ogni SIGUSR1
+    (`kill -USR1 <pid>`), nel file indicato o in BOT_STATS_PATH.
+
+    Va chiamata una volta all'avvio del bot, prima di `application.run_polling()`:
+    l'entry point del bot non è in questo repository, quindi se BOT_STATS_PATH è
+    impostata la chiama `utils.decorators` al primo import. Le chiamate successive
+    non fanno nulla.
+    """
+    global _dump_installed
+    path = path or os.environ.get("BOT_STATS_PATH", "bot_stats.json")
+    if _dump_installed:
+        return path
+    _dump_installed = True
+    atexit.register(instrumentation.dump, path)
+    # Signal handlers can only be set from the main thread
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        # Dump from a separate thread: the signal may arrive while the main thread holds the stats lock
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+            target=instrumentation.dump, args=(path,), daemon=True).start())
+    return path
@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Message stored on jobs whose worker process died before finishing them
+ORPHANED_ERROR = "Analisi interrotta dal riavvio del server. Avviala di nuovo."
+
+class JobLimitExceeded(Exception):
+    """Raised when a client already has the maximum number of active jobs."""
+
+def _process_alive(pid):
+    """Whether a process with this pid is running on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+class JobStore:
+    """In-process job store. Jobs are lost when the process exits."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def increment_rows(self, job_id, rows):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]["rows_processed"] += rows
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def count_active(self, client_id):
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if job["client_id"] == client_id and job["status"] in ACTIVE_STATES
+            )
+
+    def purge_expired(self, now):
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["expires_at"] is not None and job["expires_at"] <= now
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+    def fail_orphaned(self, now, ttl):
+        # Jobs kept in memory die with their process: none can be orphaned
+        return 0
+
+class SQLiteJobStore:
+    """Job store backed by a local SQLite file, shared by all workers on the same host."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                client_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows_processed INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                expires_at REAL,
+                result TEXT,
+                error TEXT,
+                pid INTEGER
+            )
+        ''')
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "pid" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN pid INTEGER")
+        self.conn.commit()
+
+    def _row_to_job(self, row):
+        columns = ["id", "kind", "client_id", "status", "rows_processed",
+                   "created_at", "finished_at", "expires_at", "result", "error"]
+        job = dict(zip(columns, row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, job):
+        with self._lock:
+            self.conn.execute('''
+                INSERT INTO jobs (id, kind, client_id, status, rows_processed, created_at, finished_at, expires_at, result, error, pid)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job["id"], job["kind"], job["client_id"], job["status"], job["rows_processed"],
+                  job["created_at"], job["finished_at"], job["expires_at"],
+                  json.dumps(job["result"]) if job["result"] is not None else None, job["error"], os.getpid()))
+            self.conn.commit()
+
+    def update(self, job_id, **fields):
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self.conn.commit()
+
+    def increment_rows(self, job_id, rows):
+        with self._lock:
+            self.conn.execute("UPDATE jobs SET rows_processed = rows_processed + ? WHERE id = ?", (rows, job_id))
+            self.conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.conn.execute('''
+                SELECT id, kind, client_id, status, rows_processed, created_at, finished_at, expires_at, result, error
+                FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def count_active(self, client_id):
+        with self._lock:
+            return self.conn.execute('''
+                SELECT COUNT(*) FROM jobs WHERE client_id = ? AND status IN (?, ?)
+            ''', (client_id, *ACTIVE_STATES)).fetchone()[0]
+
+    def purge_expired(self, now):
+        with self._lock:
+            cursor = self.conn.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self.conn.commit()
+            return cursor.rowcount
+
+    def fail_orphaned(self, now, ttl):
+        """
+        Segna come falliti i job attivi il cui processo non esiste più (es. dopo un riavvio),
+        così non restano in coda per sempre e non contano nel limite del client.
+
+        Un pid riusato da un altro processo non viene riconosciuto: quei job restano
+        attivi fino alla loro scadenza (`expires_at`).
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT id, pid FROM jobs WHERE status IN (?, ?)", ACTIVE_STATES).fetchall()
+            # A new process owns no job yet, so its own pid can only come from a previous run
+            orphaned = [(job_id,) for job_id, pid in rows
+                        if pid is None or pid == os.getpid() or not _process_alive(pid)]
+            self.conn.executemany('''
+                UPDATE jobs SET status = ?, error = ?, finished_at = ?, expires_at = ?
+                WHERE id = ? AND status IN (?, ?)
+            ''', [(FAILED, ORPHANED_ERROR, now, now + ttl, *job, *ACTIVE_STATES) for job in orphaned])
+            self.conn.commit()
+            return len(orphaned)
+
+class JobQueue:
+    """
+    Coda di job locale: le analisi pesanti girano su un pool di thread
+    mentre il client interroga lo stato tramite l'id del job.
+
+    Un job attivo scade dopo `timeout` secondi, uno concluso `ttl` secondi dopo la fine.
+    """
+
+    def __init__(self, store=None, max_workers=None, max_jobs_per_client=2, ttl=3600, timeout=7200):
+        self.store = store if store is not None else JobStore()
+        self.max_jobs_per_client = max_jobs_per_client
+        self.ttl = ttl
+        self.timeout = timeout
+        orphaned = self.store.fail_orphaned(time.time(), ttl)
+        if orphaned:
+            logger.warning(f"{orphaned} job interrotti da un riavvio segnati come falliti")
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1),
+                                           thread_name_prefix="job")
+        self._submit_lock = threading.Lock()
+
+    def submit(self, client_id, kind, func, *args, **kwargs):
+        """
+        Accoda `func(*args, progress=..., **kwargs)` e restituisce subito l'id del job.
+
+        Raises:
+            JobLimitExceeded: Se il client ha già `max_jobs_per_client` job attivi.
+        """
+        now = time.time()
+        self.store.purge_expired(now)
+        job_id = uuid.uuid4().hex
+        with self._submit_lock:
+            if self.store.count_active(client_id) >= self.max_jobs_per_client:
+                raise JobLimitExceeded(
+                    f"Hai già {self.max_jobs_per_client} analisi in corso. Attendi che terminino."
+                )
+            self.store.create({
+                "id": job_id,
+                "kind": kind,
+                "client_id": client_id,
+                "status": QUEUED,
+                "rows_processed": 0,
+                "created_at": now,
+                "finished_at": None,
+                # Deadline for jobs that never finish; replaced by the result TTL when they do
+                "expires_at": now + self.timeout,
+                "result": None,
+                "error": None,
+            })
+        self.executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        self.store.update(job_id, status=RUNNING)
+
+        def progress(rows):
+            self.store.increment_rows(job_id, rows)
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            finished_at = time.time()
+            # Inside the try: a result the store cannot serialize must fail the job, not leave it running
+            self.store.update(job_id, status=DONE, result=result,
+                              finished_at=finished_at, expires_at=finished_at + self.ttl)
+        except Exception as e:
+            logger.error(f"Errore nel job {job_id}: {str(e)}", exc_info=True)
+            finished_at = time.time()
+            self.store.update(job_id, status=FAILED, error=str(e),
+                              finished_at=finished_at, expires_at=finished_at + self.ttl)
+
+    def get(self, job_id):
+        """Return the job, or None if it is unknown or its result has expired."""
+        self.store.purge_expired(time.time())
+        return self.store.get(job_id)
+
+def get_client_id(request):
+    """
+    Identify the caller by its address, the key of the per-client job cap.
+
+    Headers sent by the client (such as X-Client-Id) are not used: a new value on
+    each request would bypass JOB_MAX_PER_CLIENT.
+    """
+    return request.client.host if request.client else "anonymous"
+
+def _create_job_queue():
+    store_path = os.environ.get("JOB_STORE_PATH")
+    store = SQLiteJobStore(store_path) if store_path else JobStore()
+    return JobQueue(
+        store=store,
+        max_workers=int(os.environ.get("JOB_WORKERS", "0")) or None,
+        max_jobs_per_client=int(os.environ.get("JOB_MAX_PER_CLIENT", "2")),
+        ttl=int(os.environ.get("JOB_RESULT_TTL", "3600")),
+        timeout=int(os.environ.get("JOB_TIMEOUT", "7200")),
+    )
+
+job_queue = _create_job_queue()
@@ -1,4 +1,8 @@
 import math
+import numpy as np
+
+# Fractions of the Kelly stake offered by /calcola and replayed in the backtest
+KELLY_FRACTIONS = [(1/8, "1/8"), (1/10, "1/10"), (1/15, "1/15"), (1/20, "1/20")]
 
 def kelly_criterion(odds: float, probability: float) -> float:
     """
@@ -36,4 +40,21 @@ def round_to_nearest_five_cents(amount: float) -> float:
     # Scegli il valore più vicino
     if abs(amount - floor_amount) <= abs(amount - ceil_amount):
         return floor_amount
-    return ceil_amount
\ No newline at end of file
+    return ceil_amount
+
+def round_to_nearest_five_cents_array(amounts: np.ndarray) -> np.ndarray:
+    """
+    Versione vettoriale di `round_to_nearest_five_cents`, con le stesse operazioni
+    in virgola mobile e la stessa scelta per difetto in caso di parità.
+
+    Args:
+        amounts (np.ndarray): Importi da arrotondare.
+
+    Returns:
+        np.ndarray: Importi arrotondati al multiplo di 5 centesimi più vicino.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    cents = amounts * 100
+    floor_amount = np.floor(cents / 5) * 5 / 100
+    ceil_amount = np.ceil(cents / 5) * 5 / 100
+    return np.where(np.abs(amounts - floor_amount) <= np.abs(amounts - ceil_amount), floor_amount, ceil_amount)
@@ -0,0 +1,214 @@
+import gzip
+import io
+import lzma
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Number of rows parsed per chunk when reading an uploaded ledger
+LEDGER_CHUNK_ROWS = 50_000
+
+# Columns identifying the same bet across overlapping exports
+BET_KEY_COLUMNS = ['Data', 'Titolo della scommessa', 'Quote', 'Puntata', 'Bookmaker']
+
+DATE_FORMAT = '%d/%m/%Y %H:%M'
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Cap on the decompressed size of a compressed upload, against decompression bombs
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("LEDGER_MAX_DECOMPRESSED_MB", "512")) * 1024 * 1024
+
+class DecompressionLimitExceeded(ValueError):
+    """Raised when a compressed upload expands beyond MAX_DECOMPRESSED_BYTES."""
+
+class _LimitedReader(io.RawIOBase):
+    """Raw stream that stops with an error once more than `limit` bytes have been read."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        size = len(data)
+        self.total += size
+        if self.total > self.limit:
+            raise DecompressionLimitExceeded(
+                f"Il file decompresso supera il limite di {self.limit // (1024 * 1024)} MB."
+            )
+        buffer[:size] = data
+        return size
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+def open_ledger(source, max_bytes=MAX_DECOMPRESSED_BYTES):
+    """
+    Apre un upload come stream binario, decomprimendolo al volo se è gzip, xz o zstd.
+
+    Il formato è riconosciuto dai magic bytes; i file non compressi sono restituiti così come sono.
+
+    Args:
+        source: Contenuto del file (bytes) oppure file binario già aperto.
+        max_bytes (int): Dimensione massima del contenuto decompresso.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    if source.seekable():
+        position = source.tell()
+        head = source.read(len(XZ_MAGIC))
+        source.seek(position)
+    else:
+        source = io.BufferedReader(source)
+        head = source.peek(len(XZ_MAGIC))[:len(XZ_MAGIC)]
+
+    if head.startswith(GZIP_MAGIC):
+        stream = gzip.GzipFile(fileobj=source, mode='rb')
+    elif head.startswith(XZ_MAGIC):
+        stream = lzma.LZMAFile(source, mode='rb')
+    elif head.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("I file zstd richiedono il pacchetto 'zstandard' (pip install zstandard).") from None
+        # closefd=False: like gzip and xz, leave the upload open for a second pass
+        stream = zstandard.ZstdDecompressor().stream_reader(source, closefd=False)
+    else:
+        return source
+    return io.BufferedReader(_LimitedReader(stream, max_bytes))
+
+def iter_ledger(source, chunksize=LEDGER_CHUNK_ROWS):
+    """
+    Itera un export Bet-Analytix (separatore ';') a blocchi di `chunksize` righe.
+
+    Gli upload compressi (gzip, xz, zstd) sono decompressi in streaming
+    direttamente nel parser, senza una copia completa in memoria.
+
+    Args:
+        source: Contenuto del file (bytes) oppure file binario già aperto.
+    """
+    source = open_ledger(source)
+    with pd.read_csv(source, sep=';', encoding='utf-8', chunksize=chunksize) as reader:
+        yield from reader
+
+def read_ledger(source, progress=None, chunksize=LEDGER_CHUNK_ROWS):
+    """
+    Legge un export Bet-Analytix (separatore ';') a blocchi.
+
+    Args:
+        source: Contenuto del file (bytes, anche compresso) oppure file binario già aperto.
+        progress (callable, optional): Chiamata con il numero di righe lette dopo ogni blocco.
+        chunksize (int): Righe per blocco.
+
+    Returns:
+        pd.DataFrame: Il ledger completo.
+    """
+    chunks = []
+    for chunk in iter_ledger(source, chunksize):
+        chunks.append(chunk)
+        if progress is not None:
+            progress(len(chunk))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def to_number(series: pd.Series):
+    """Convert a column with decimal commas ('2,30') to floats; invalid values become NaN."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    return pd.to_numeric(series.astype(str).str.replace(',', '.'), errors='coerce')
+
+def bet_hashes(df: pd.DataFrame):
+    """64-bit hash of the columns that identify a bet, one per row."""
+    columns = [col for col in BET_KEY_COLUMNS if col in df.columns]
+    keys = df[columns].astype(str)
+    if 'Data' in columns and pd.api.types.is_datetime64_any_dtype(df['Data']):
+        # Hash the export format, so a bet hashes the same before and after date parsing
+        keys['Data'] = df['Data'].dt.strftime(DATE_FORMAT)
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def _parse_for_merge(content):
+    df = read_ledger(content)
+    return df, bet_hashes(df)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _parse_workers():
+    return int(os.environ.get("LEDGER_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+def _get_pool():
+    """Process pool shared by all requests, so the worker start-up cost is paid once."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a multi-threaded server process is not safe
+            _pool = ProcessPoolExecutor(max_workers=_parse_workers(),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def parse_ledgers(contents, progress=None):
+    """
+    Legge più export in parallelo, uno per processo.
+
+    Returns:
+        list: Coppie (DataFrame, hash delle scommesse) nello stesso ordine di `contents`.
+    """
+    if len(contents) == 1 or _parse_workers() == 1:
+        parsed = []
+        for content in contents:
+            df, hashes = _parse_for_merge(content)
+            if progress is not None:
+                progress(len(df))
+            parsed.append((df, hashes))
+        return parsed
+
+    pool = _get_pool()
+    futures = {pool.submit(_parse_for_merge, content): i for i, content in enumerate(contents)}
+    parsed = [None] * len(contents)
+    for future in as_completed(futures):
+        df, hashes = future.result()
+        if progress is not None:
+            progress(len(df))
+        parsed[futures[future]] = (df, hashes)
+    return parsed
+
+def merge_ledgers(parsed):
+    """
+    Unisce più ledger in ordine di data, eliminando le scommesse presenti in più export.
+
+    Di ogni scommessa restano le righe del primo file che la contiene: le righe identiche
+    nello stesso export (es. due puntate uguali) sono scommesse distinte e non vengono rimosse.
+
+    Args:
+        parsed (list): Coppie (DataFrame, hash) restituite da `parse_ledgers`.
+
+    Returns:
+        tuple: (DataFrame unito, numero di duplicati rimossi)
+    """
+    merged = pd.concat([df for df, _ in parsed], ignore_index=True)
+    hashes = np.concatenate([h for _, h in parsed])
+
+    file_index = np.repeat(np.arange(len(parsed)), [len(h) for _, h in parsed])
+
+    # Files are concatenated in order, so the first occurrence of a hash is in the first file containing it
+    _, first_seen, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    keep = file_index == file_index[first_seen][inverse]
+    duplicates = len(merged) - int(keep.sum())
+
+    return sort_by_date(merged[keep]), duplicates
+
+def sort_by_date(df: pd.DataFrame):
+    """Ledger rows oldest first, with 'Data' parsed (exports list the newest bets first); ties keep their order."""
+    df = df.assign(Data=pd.to_datetime(df['Data'], format=DATE_FORMAT, errors='coerce'))
+    return df.sort_values('Data', kind='stable').reset_index(drop=True)
@@ -0,0 +1,91 @@
+import bisect
+import numpy as np
+import pandas as pd
+
+MARKET_ORDER = ['1X2', 'Over/Under', 'Entrambe segnano', 'Handicap', 'Corner', 'Cartellini', 'Altro']
+
+# Inner edges of the default odds buckets; each bucket includes its lower edge
+ODDS_EDGES = (1.5, 1.8, 2.5, 3.5, 5.0)
+MAX_ODDS_BUCKETS = 20
+
+def get_market_from_title(title):
+    if pd.isna(title): return "Altro"
+    title_lower = str(title).lower()
+    if any(keyword in title_lower for keyword in ['under', 'over', 'o/u']): return 'Over/Under'
+    if any(keyword in title_lower for keyword in ['1x2', '1)', '2)', 'x)', '(1x)', '(x2)', 'x2', '1x']): return '1X2'
+    if any(keyword in title_lower for keyword in ['entrambe', 'segnano', 'gg', 'both teams', 'btts']): return 'Entrambe segnano'
+    if any(keyword in title_lower for keyword in ['handicap', 'spread', 'asian']): return 'Handicap'
+    if any(keyword in title_lower for keyword in ['corner', 'angolo', 'calcio d\'angolo']): return 'Corner'
+    if any(keyword in title_lower for keyword in ['card', 'cartell', 'ammonizio']): return 'Cartellini'
+    return 'Altro'
+
+def _format_edge(edge):
+    """1.5 -> '1.5', 5 -> '5.0', 1.65 -> '1.65'"""
+    text = f"{edge:.2f}".rstrip('0')
+    return text + '0' if text.endswith('.') else text
+
+def odds_labels(edges=ODDS_EDGES):
+    """Bucket labels for the given inner edges: '< 1.5', '1.5-1.8', ..., '5.0+'."""
+    names = [_format_edge(edge) for edge in edges]
+    return [f"< {names[0]}"] + [f"{low}-{high}" for low, high in zip(names, names[1:])] + [f"{names[-1]}+"]
+
+ODDS_ORDER = odds_labels()
+
+def get_odds_range(odds, edges=ODDS_EDGES, labels=ODDS_ORDER):
+    """Bucket label of a single odds value (see `bucket_odds` for whole columns)."""
+    if pd.isna(odds): return "N/A"
+    return labels[bisect.bisect_right(edges, float(odds))]
+
+def parse_odds_edges(text):
+    """
+    Legge i limiti delle fasce di quota inseriti dall'utente ('1.6, 2; 3,5').
+
+    Returns:
+        tuple | None: Limiti ordinati e senza duplicati, o None se il testo è vuoto.
+    """
+    if text is None or not str(text).strip():
+        return None
+    items = [item for item in str(text).replace(';', ' ').replace(', ', ' ').split() if item]
+    try:
+        edges = sorted({round(float(item.replace(',', '.')), 2) for item in items})
+    except ValueError:
+        raise ValueError(f"Fasce di quota non valide: '{text}'. Usa numeri separati da spazi o ';'.")
+    if edges[0] <= 1:
+        raise ValueError("I limiti delle fasce di quota devono essere maggiori di 1.")
+    if len(edges) >= MAX_ODDS_BUCKETS:
+        raise ValueError(f"Al massimo {MAX_ODDS_BUCKETS} fasce di quota.")
+    return tuple(edges)
+
+def check_odds_quantiles(bins):
+    """Validate the number of equal-frequency buckets (0 means default buckets)."""
+    if bins and not 2 <= bins <= MAX_ODDS_BUCKETS:
+        raise ValueError(f"Il numero di fasce deve essere compreso fra 2 e {MAX_ODDS_BUCKETS}.")
+    return bins
+
+def quantile_odds_edges(odds, bins):
+    """
+    Limiti di `bins` fasce con lo stesso numero di scommesse, calcolati dalle quote del ledger.
+
+    Quote molto ripetute possono far coincidere due quantili: in quel caso le fasce sono meno di `bins`.
+    """
+    check_odds_quantiles(bins)
+    odds = np.asarray(odds, dtype=float)
+    odds = odds[~np.isnan(odds)]
+    if len(odds) == 0:
+        return ODDS_EDGES
+    edges = np.unique(np.round(np.quantile(odds, np.linspace(0, 1, bins + 1)[1:-1]), 2))
+    # An edge equal to the lowest odds would leave the first bucket empty
+    edges = edges[edges > odds.min()]
+    return tuple(edges.tolist()) or ODDS_EDGES
+
+def bucket_odds(odds, edges=ODDS_EDGES):
+    """
+    Assegna le fasce di quota a un'intera colonna con una sola chiamata a `pd.cut`.
+
+    Returns:
+        tuple: (pd.Series categorica di etichette, 'N/A' per le quote mancanti; lista ordinata delle etichette)
+    """
+    labels = odds_labels(edges)
+    odds = pd.Series(odds, dtype=float) if not isinstance(odds, pd.Series) else odds.astype(float)
+    buckets = pd.cut(odds, bins=[-np.inf, *edges, np.inf], labels=labels, right=False)
+    return buckets.cat.add_categories("N/A").fillna("N/A"), labels
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from utils.ledger import to_number
+
+# Outcome codes used by the metrics kernel
+OUTCOME_OTHER = 0
+OUTCOME_WIN = 1
+OUTCOME_LOSS = 2
+OUTCOME_VOID = 3
+
+OUTCOME_CODES = {'Vinto': OUTCOME_WIN, 'Perso': OUTCOME_LOSS, 'Nullo': OUTCOME_VOID}
+
+def encode_outcomes(stato):
+    """
+    Codifica la colonna 'Stato' in codici interi con una sola fattorizzazione.
+
+    Returns:
+        tuple: (codici int8, maschera dei valori mancanti, maschera dei rimborsi)
+    """
+    codes, uniques = pd.factorize(stato)
+    lut = np.array([OUTCOME_CODES.get(value, OUTCOME_OTHER) for value in uniques] + [OUTCOME_OTHER], dtype=np.int8)
+    refund_lut = np.array([value == 'Rimborso' for value in uniques] + [False])
+    # factorize marks missing values with -1, which indexes the trailing placeholder
+    return lut[codes], codes < 0, refund_lut[codes]
+
+def day_numbers(dates):
+    """Integer day index (days since the epoch) of a datetime column, without resampling."""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+def clean_bets(df: pd.DataFrame):
+    """
+    Estrae dal ledger gli array usati da `betting_metrics`, senza modificare il DataFrame.
+
+    Scarta le righe senza data, puntata, quota o stato e i rimborsi; se il profitto
+    non è presente lo ricava da esito, puntata e quota.
+
+    Returns:
+        tuple: (dict con gli array `outcome`, `stake`, `odds`, `profit`, `day`,
+                maschera delle righe tenute oppure None se sono tutte valide)
+    """
+    # Accept both the export column names and the cleaned ones ('Titolo_della_scommessa')
+    columns = {col.strip().replace(' ', '_'): col for col in df.columns}
+    # Exports use day-first dates ('19/06/2025 23:29')
+    dates = pd.to_datetime(df[columns['Data']], dayfirst=True, errors='coerce').to_numpy()
+    stake = to_number(df[columns['Puntata']]).to_numpy()
+    odds = to_number(df[columns['Quote']]).to_numpy()
+    if 'Profitto' in columns:
+        profit = to_number(df[columns['Profitto']]).to_numpy()
+    else:
+        profit = np.full(len(df), np.nan)
+    outcome, missing_status, refund = encode_outcomes(df[columns['Stato']])
+
+    invalid = np.isnat(dates) | np.isnan(stake) | np.isnan(odds) | missing_status | refund
+    valid = None
+    if invalid.any():
+        valid = ~invalid
+        dates, stake, odds, profit, outcome = dates[valid], stake[valid], odds[valid], profit[valid], outcome[valid]
+
+    if np.isnan(profit).all():
+        profit = np.where(outcome == OUTCOME_WIN, stake * odds - stake, -stake)
+        profit[outcome == OUTCOME_VOID] = 0
+
+    arrays = {"outcome": outcome, "stake": stake, "odds": odds, "profit": profit, "day": day_numbers(dates)}
+    return arrays, valid
+
+def betting_arrays(df: pd.DataFrame):
+    """Arrays of the valid bets in the ledger, ready for `betting_metrics`."""
+    return clean_bets(df)[0]
+
+def betting_metrics(outcome, stake, odds, profit, day):
+    """
+    Calcola tutte le statistiche del backtest su array semplici.
+
+    Args:
+        outcome (np.ndarray): Codici OUTCOME_* (int8).
+        stake (np.ndarray): Puntate.
+        odds (np.ndarray): Quote.
+        profit (np.ndarray): Profitto per scommessa (NaN se sconosciuto).
+        day (np.ndarray): Giorno di ogni scommessa come intero (vedi `day_numbers`).
+
+    Returns:
+        dict: Statistiche numeriche non formattate.
+    """
+    total_bets = len(outcome)
+    counts = np.bincount(outcome, minlength=4)
+    if total_bets == 0:
+        return {
+            "total_bets": 0, "wins": 0, "losses": 0, "voids": 0,
+            "avg_odds": np.nan, "total_staked": 0.0, "total_profit": 0.0,
+            "max_drawdown": np.nan, "profit_mean": np.nan, "profit_std": np.nan, "sharpe_ratio": 0,
+        }
+
+    missing = np.isnan(profit)
+    n_missing = int(missing.sum())
+    if n_missing:
+        profit = np.where(missing, 0.0, profit)
+
+    # Running profit and drawdown, reusing the same two buffers
+    cumulative = np.cumsum(profit)
+    drawdown = np.maximum.accumulate(cumulative)
+    np.subtract(cumulative, drawdown, out=drawdown)
+    total_profit = float(cumulative[-1])
+    max_drawdown = float(drawdown.min())
+
+    n_profit = total_bets - n_missing
+    profit_mean = total_profit / n_profit if n_profit else np.nan
+    valid_profit = profit[~missing] if n_missing else profit
+    profit_std = float(valid_profit.std(ddof=1)) if n_profit > 1 else np.nan
+
+    # Daily profit bucketed by day index; empty days count as 0, like resample('D').sum()
+    first_day = day.min()
+    daily_profit = np.bincount(day - first_day, weights=profit)
+    daily_std = daily_profit.std(ddof=1) if len(daily_profit) > 1 else 0
+    if len(daily_profit) > 1 and daily_std != 0:
+        sharpe_ratio = (daily_profit.mean() / daily_std) * np.sqrt(365)
+    else:
+        sharpe_ratio = 0
+
+    return {
+        "total_bets": total_bets,
+        "wins": int(counts[OUTCOME_WIN]),
+        "losses": int(counts[OUTCOME_LOSS]),
+        "voids": int(counts[OUTCOME_VOID]),
+        "avg_odds": float(odds.mean()),
+        "total_staked": float(stake.sum()),
+        "total_profit": total_profit,
+        "max_drawdown": max_drawdown,
+        "profit_mean": profit_mean,
+        "profit_std": profit_std,
+        "sharpe_ratio": sharpe_ratio,
+    }
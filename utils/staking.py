@@ -0,0 +1,110 @@
+import numpy as np
+
+from utils.kelly import KELLY_FRACTIONS, round_to_nearest_five_cents_array
+from utils.metrics import OUTCOME_WIN, OUTCOME_LOSS
+
+DEFAULT_BANKROLL = 1000.0
+# Probability used for Kelly = implied probability + edge
+DEFAULT_EDGE = 0.02
+# Flat stake as a fraction of the initial bankroll
+FLAT_STAKE_FRACTION = 0.01
+
+def kelly_strategy(fraction, label, edge=DEFAULT_EDGE):
+    return {"name": f"Kelly {label}", "fraction": fraction, "flat_stake": 0.0, "edge": edge}
+
+def flat_strategy(stake, name=None):
+    return {"name": name or f"Flat {stake:.2f}", "fraction": None, "flat_stake": stake, "edge": 0.0}
+
+def default_strategies(edge=DEFAULT_EDGE, initial_bankroll=DEFAULT_BANKROLL):
+    """Puntata fissa e Kelly frazionato alle stesse frazioni proposte da /calcola."""
+    strategies = [flat_strategy(initial_bankroll * FLAT_STAKE_FRACTION, "Flat")]
+    strategies += [kelly_strategy(fraction, label, edge) for fraction, label in KELLY_FRACTIONS]
+    return strategies
+
+def kelly_grid(fractions, edges):
+    """Every (fraction, edge) pair as a Kelly strategy, for parameter sweeps."""
+    return [kelly_strategy(fraction, f"{fraction:.4g}", edge) for edge in edges for fraction in fractions]
+
+def replay_strategies(outcome, odds, day, strategies, initial_bankroll=DEFAULT_BANKROLL):
+    """
+    Rigioca le stesse scommesse con K strategie di puntata contemporaneamente.
+
+    Le scommesse sono scorse in ordine una alla volta, perché ogni puntata Kelly
+    dipende dal bankroll lasciato dalla precedente; ad ogni passo tutte le K
+    strategie sono aggiornate con operazioni su array. Le puntate sono arrotondate
+    a 5 centesimi come in /calcola e non superano mai il bankroll disponibile.
+
+    Args:
+        outcome (np.ndarray): Codici OUTCOME_* (vedi `utils.metrics`), in ordine cronologico.
+        odds (np.ndarray): Quote.
+        day (np.ndarray): Giorno di ogni scommessa come intero (vedi `day_numbers`).
+        strategies (list): Dict con `name`, `fraction` (None per la puntata fissa), `flat_stake`, `edge`.
+        initial_bankroll (float): Bankroll di partenza comune a tutte le strategie.
+
+    Returns:
+        list: Per ogni strategia bankroll finale, puntato, profitto, ROI, max drawdown e Sharpe Ratio.
+    """
+    n_bets = len(outcome)
+    is_kelly = np.array([strategy["fraction"] is not None for strategy in strategies])
+    fraction = np.array([strategy["fraction"] or 0.0 for strategy in strategies])
+    flat_stake = np.array([strategy["flat_stake"] for strategy in strategies], dtype=float)
+    edge = np.array([strategy["edge"] for strategy in strategies], dtype=float)
+
+    odds = np.asarray(odds, dtype=float)
+    valid_odds = odds > 1
+    won = outcome == OUTCOME_WIN
+    lost = outcome == OUTCOME_LOSS
+    day_index = day - day.min() if n_bets else day
+    daily_profit = np.zeros((int(day_index.max()) + 1 if n_bets else 1, len(strategies)))
+
+    bankroll = np.full(len(strategies), float(initial_bankroll))
+    peak = bankroll.copy()
+    max_drawdown = np.zeros(len(strategies))
+    staked = np.zeros(len(strategies))
+    bets_placed = np.zeros(len(strategies), dtype=np.int64)
+
+    for i in range(n_bets):
+        if not (won[i] or lost[i]):
+            continue  # Voids return the stake and leave every bankroll unchanged
+        if valid_odds[i]:
+            probability = 1 / odds[i] + edge
+            kelly = (odds[i] * probability - 1) / (odds[i] - 1)
+            kelly[(probability <= 0) | (probability >= 1) | (kelly < 0)] = 0
+        else:
+            kelly = np.zeros(len(strategies))
+        stake = np.where(is_kelly, kelly * bankroll * fraction, flat_stake)
+        stake = np.minimum(round_to_nearest_five_cents_array(stake), np.maximum(bankroll, 0))
+
+        profit = stake * (odds[i] - 1) if won[i] else -stake
+        bankroll += profit
+        staked += stake
+        bets_placed += stake > 0
+        daily_profit[day_index[i]] += profit
+        np.maximum(peak, bankroll, out=peak)
+        np.minimum(max_drawdown, bankroll - peak, out=max_drawdown)
+
+    # Same daily Sharpe as the backtest: empty days count as 0
+    if len(daily_profit) > 1:
+        daily_std = daily_profit.std(axis=0, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = np.where(daily_std != 0, daily_profit.mean(axis=0) / daily_std * np.sqrt(365), 0)
+    else:
+        sharpe = np.zeros(len(strategies))
+
+    profit = bankroll - initial_bankroll
+    results = []
+    for k, strategy in enumerate(strategies):
+        results.append({
+            "name": strategy["name"],
+            "fraction": strategy["fraction"],
+            "edge": strategy["edge"],
+            "bets_placed": int(bets_placed[k]),
+            "final_bankroll": float(bankroll[k]),
+            "total_staked": float(staked[k]),
+            "total_profit": float(profit[k]),
+            "roi": float(profit[k] / staked[k] * 100) if staked[k] > 0 else 0.0,
+            "growth": float(profit[k] / initial_bankroll * 100),
+            "max_drawdown": float(max_drawdown[k]),
+            "sharpe_ratio": float(sharpe[k]),
+        })
+    return results
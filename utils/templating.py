@@ -0,0 +1,86 @@
+import logging
+import os
+from itertools import islice
+
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+# Get the absolute path of the project's root directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+
+logger = logging.getLogger(__name__)
+
+# Re-read templates changed on disk only when asked to (development)
+TEMPLATE_AUTO_RELOAD = os.environ.get("TEMPLATE_AUTO_RELOAD", "0") == "1"
+
+# Streamed pages are sent in pieces joining this many template outputs (a few tens of KB)
+STREAM_CHUNK_ITEMS = 2048
+# Only pages longer than this are streamed
+STREAM_MIN_CHARS = 256 * 1024
+STREAM_ERROR_HTML = '<p style="color: red;">Errore: generazione della pagina interrotta, il risultato è incompleto.</p>'
+
+def create_environment(directory=TEMPLATES_DIR, cache_dir=None, auto_reload=TEMPLATE_AUTO_RELOAD):
+    """
+    Crea l'ambiente Jinja condiviso da tutte le pagine.
+
+    I template compilati sono salvati in una cache su disco (TEMPLATE_CACHE_DIR,
+    altrimenti la cartella temporanea di sistema), così i nuovi worker e i cold
+    start non ricompilano ogni template.
+    """
+    cache_dir = cache_dir or os.environ.get("TEMPLATE_CACHE_DIR")
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(directory),
+        autoescape=select_autoescape(),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        auto_reload=auto_reload,
+    )
+
+env = create_environment()
+templates = Jinja2Templates(env=env)
+
+def _buffered(chunks, items):
+    """Join the many small pieces produced by Jinja, `items` at a time."""
+    chunks = iter(chunks)
+    while True:
+        batch = list(islice(chunks, items))
+        if not batch:
+            return
+        yield "".join(batch)
+
+def _rest_of_page(head, chunks, name):
+    yield head
+    try:
+        yield from chunks
+    except Exception as e:
+        # The status line is already sent: say the page is incomplete instead of cutting it silently
+        logger.error(f"Error rendering {name}: {e}", exc_info=True)
+        yield STREAM_ERROR_HTML
+
+def stream_template(name, context, status_code=200):
+    """
+    Render a template piece by piece into a StreamingResponse.
+
+    The first STREAM_MIN_CHARS are rendered before returning, so rendering errors
+    reach the caller's error handling; pages shorter than that are sent whole.
+    The rest of a longer page is rendered in the threadpool while it is sent.
+    """
+    template = templates.get_template(name)
+    chunks = _buffered(template.generate(context), STREAM_CHUNK_ITEMS)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_MIN_CHARS:
+            break
+    else:
+        return HTMLResponse("".join(head), status_code=status_code)
+    return StreamingResponse(
+        _rest_of_page("".join(head), chunks, name),
+        status_code=status_code,
+        media_type="text/html; charset=utf-8",
+    )